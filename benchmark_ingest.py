@@ -0,0 +1,226 @@
+import argparse
+import json
+import logging
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import boto3
+import pymongo
+from botocore.client import Config
+from generate_catalog import CatalogGenerator, load_catalog_names, plan_catalog, upload_catalog
+
+logger = logging.getLogger(__name__)
+
+BENCH_BUCKET = 'bench-bubbo'
+BENCH_PREFIX = 'Content/latest/'
+BENCH_DATABASE = 'bubbo_bench'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+@contextmanager
+def local_s3(endpoint=None):
+    """Yield an S3 endpoint URL, starting a moto server subprocess unless one is given."""
+    if endpoint:
+        yield endpoint
+        return
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+@contextmanager
+def local_mongo(target):
+    """Yield a MongoDB URI for 'mongod' (temporary local server), 'mongomock' (in-memory) or a given URI."""
+    if target == 'mongod':
+        mongod = shutil.which('mongod')
+        if mongod is None:
+            raise RuntimeError("mongod is not on PATH; use --mongo mongomock or pass a URI")
+        port = free_port()
+        dbpath = tempfile.mkdtemp(prefix='bench-mongo-')
+        process = subprocess.Popen(
+            [mongod, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port)
+            yield f"mongodb://127.0.0.1:{port}"
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(dbpath, ignore_errors=True)
+    elif target == 'mongomock':
+        import mongomock
+        from mongomock.collection import BulkOperationBuilder
+
+        # Newer pymongo passes sort= to the bulk builder, which mongomock does not accept
+        original_add_update = BulkOperationBuilder.add_update
+
+        def add_update(self, *args, sort=None, **kwargs):
+            return original_add_update(self, *args, **kwargs)
+
+        # Every MongoClient the ingester opens must see the same in-memory data
+        client = mongomock.MongoClient()
+        original = pymongo.MongoClient
+        pymongo.MongoClient = lambda *args, **kwargs: client
+        BulkOperationBuilder.add_update = add_update
+        try:
+            yield 'mongomock://'
+        finally:
+            pymongo.MongoClient = original
+            BulkOperationBuilder.add_update = original_add_update
+    else:
+        yield target
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB."""
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def configure(module, endpoint, mongo_uri):
+    """Point an ingester module's CONFIG at the local stand-ins."""
+    module.CONFIG['do_spaces'].update({
+        'access_key': 'bench',
+        'secret_key': 'bench',
+        'endpoint': endpoint,
+        'bucket': BENCH_BUCKET,
+        'prefix': BENCH_PREFIX
+    })
+    mongodb = module.CONFIG['mongodb']
+    mongodb.update({'host': mongo_uri, 'username': None, 'password': None, 'database': BENCH_DATABASE})
+    mongodb.pop('ssl', None)
+    mongodb.pop('ssl_ca_certs', None)
+
+def run_ingester(args, endpoint, mongo_uri):
+    import deeplinks_timestamps_update as ingester
+
+    configure(ingester, endpoint, mongo_uri)
+    ingester.CONFIG['processing']['parse_mode'] = args.parse_mode
+    ingester.CONFIG['logging']['progress_interval'] = args.progress_interval
+    metrics = ingester.process_do_spaces_files(full_refresh=True)
+    return {
+        'lines': metrics['total_lines'],
+        'bytes': metrics['progress']['bytes'],
+        'changed_lines': metrics['changed_lines'],
+        'error_files': len(metrics['error_files']),
+        # Reported by the workers themselves: they are forkserver children, not ours
+        'peak_worker_rss_mb': round(metrics['parse_worker_peak_rss_mb'], 1),
+        'stages': {
+            stage: round(metrics['progress'][f'{stage}_seconds'], 3)
+            for stage in ('download', 'parse', 'write')
+        }
+    }
+
+def run_spark(args, endpoint, mongo_uri):
+    import pypark
+
+    configure(pypark, endpoint, mongo_uri)
+    metrics = pypark.process_do_spaces_files()
+    return {
+        'lines': metrics['total_lines'],
+        'changed_lines': metrics['inserted_lines'],
+        'error_files': len(metrics['error_files']) + (1 if metrics['write_errors'] else 0)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Spaces -> MongoDB ingest against local stand-ins.")
+    parser.add_argument('--target', choices=['ingester', 'spark'], default='ingester')
+    parser.add_argument('--objects', type=int, default=4, help="Number of synthetic objects to seed.")
+    parser.add_argument('--lines', type=int, default=50000, help="Average lines per synthetic object.")
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of lines per platform.")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--parse-mode', choices=['threads', 'processes'], default='threads')
+    parser.add_argument('--s3-endpoint', help="Use an existing S3-compatible endpoint instead of starting moto.")
+    parser.add_argument(
+        '--mongo',
+        default='mongod',
+        help="'mongod' starts a temporary local server, 'mongomock' runs in memory (unindexed, so it "
+             "checks the pipeline end to end rather than measuring write speed), anything else is a MongoDB URI."
+    )
+    parser.add_argument('--progress-interval', type=float, default=5)
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with local_s3(args.s3_endpoint) as endpoint, local_mongo(args.mongo) as mongo_uri:
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id='bench',
+            aws_secret_access_key='bench',
+            endpoint_url=endpoint,
+            config=Config(signature_version='s3v4'),
+            region_name='us-east-1'
+        )
+        s3_client.create_bucket(Bucket=BENCH_BUCKET)
+        plan = plan_catalog(load_catalog_names(), args.objects * args.lines, args.skew, args.objects, args.seed)
+        generator = CatalogGenerator(args.seed, duplicate_rate=args.duplicate_rate, malformed_rate=args.malformed_rate)
+        objects, total_bytes, total_lines = upload_catalog(generator, plan, s3_client, BENCH_BUCKET, BENCH_PREFIX)
+        logger.info(f"Seeded {objects} objects, {total_lines} lines, {total_bytes / 1024 / 1024:.1f} MB")
+
+        started = time.monotonic()
+        if args.target == 'spark':
+            details = run_spark(args, endpoint, mongo_uri)
+        else:
+            details = run_ingester(args, endpoint, mongo_uri)
+        elapsed = time.monotonic() - started
+        own_rss = peak_rss_mb()
+
+    # Throughput of what was actually ingested, not of what was seeded
+    ingested_bytes = details.pop('bytes', None)
+    result = {
+        'target': args.target,
+        'parse_mode': args.parse_mode,
+        'mongo': args.mongo,
+        'objects': objects,
+        'seeded_lines': total_lines,
+        'seeded_mb': round(total_bytes / 1024 / 1024, 2),
+        'seconds': round(elapsed, 3),
+        'lines_per_s': round(details['lines'] / elapsed, 1),
+        'mb_per_s': None if ingested_bytes is None else round(ingested_bytes / 1024 / 1024 / elapsed, 2),
+        'peak_rss_mb': round(own_rss, 1),
+        **details
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for field, value in result.items():
+            print(f"{field:>18}: {value}")
+
+    if details['error_files'] or not details['changed_lines']:
+        logger.error(f"Benchmark run failed: {details['error_files']} error files, {details['changed_lines']} lines written")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,54 @@
+import argparse
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from array import array
 import pymongo
-import boto3
-from botocore.client import Config
+from pymongo import UpdateOne
+import bson
+from bson.raw_bson import RawBSONDocument
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from queue import Queue
+from threading import Lock, Thread
+from typing import NamedTuple, Optional
+from id_filter import BloomFilter, may_be_wanted
+from mongo_bulk import BulkUpsertWriter
+from mongo_indexes import (
+    PLAN_CHECK_MIN_DOCUMENTS,
+    TITLE_INDEXES,
+    TITLE_QUERIES,
+    IndexBootstrapError,
+    bootstrap_indexes
+)
+from spaces_client import AimdLimiter, create_spaces_client
+from spaces_reader import (
+    DEFAULT_CHUNK_SIZE,
+    RANGE_SIZE,
+    compression_from_key,
+    iter_object_line_blocks,
+    iter_object_range_blocks
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Logging configuration remains the same
 logging.basicConfig(
@@ -32,10 +76,90 @@ CONFIG = {
         'password': 'bubbomaster',
         'auth_source': 'admin',
         'database': 'bubbo',
-        'collection': 'processed_files'
+        'collection': 'processed_files',
+        # One document per extracted_id with every file's deeplinks, for the 'per_title' layout
+        'titles_collection': 'deeplink_titles',
+        # ETag/size of every Spaces object already ingested, keyed by object key
+        'manifest_collection': 'sync_manifest',
+        # Refuse to ingest when a hot query would scan a collection at least this large
+        'plan_check_min_documents': PLAN_CHECK_MIN_DOCUMENTS
+    },
+    'processing': {
+        # 'auto' uses orjson when it is installed and falls back to the stdlib json module
+        'json_backend': 'auto',
+        # Number of UpdateOne operations sent per bulk_write
+        'batch_size': 1000,
+        # Bytes read from each Spaces object per chunk while streaming lines
+        'read_chunk_size': DEFAULT_CHUNK_SIZE,
+        # Pipeline sizing: concurrent object downloads, parse threads and MongoDB writer connections
+        'downloaders': 4,
+        'parsers': os.cpu_count() or 1,
+        'writers': 2,
+        # Chunks (blocks of about read_chunk_size bytes of complete lines) buffered
+        # between stages before the upstream stage blocks
+        'queue_size': 16,
+        # 'threads' parses chunks in the pipeline threads; 'processes' ships them
+        # to a pool of 'parsers' worker processes
+        'parse_mode': 'threads',
+        # Bloom filter file of wanted IDs built by id_filter.py; lines whose ID is not
+        # in it are dropped before the JSON decode. None keeps every line
+        'id_filter': None,
+        # Objects of at least ranged_threshold bytes are fetched as range_workers
+        # concurrent GETs of range_size bytes each
+        'ranged_threshold': 64 * 1024 * 1024,
+        'range_size': RANGE_SIZE,
+        'range_workers': 4,
+        # Spaces GETs in flight across the whole run; an AIMD limiter moves between
+        # these bounds, widening while range latency holds and halving on SlowDown
+        'spaces_requests': {'initial': 8, 'minimum': 1, 'maximum': 32},
+        # Parse ranges as they arrive instead of in object order; line numbers
+        # are then not tracked (stored as None)
+        'ranged_unordered': False,
+        # Record the committed prefix of each object after every written chunk
+        'checkpoints': True,
+        # (index, count) to ingest only shard index of count, None for every object.
+        # 'hash' assigns objects by key hash, 'size' balances listed bytes across shards;
+        # both only need every worker to see the same listing
+        'shard': None,
+        'shard_strategy': 'hash',
+        # After a complete, non-resumed object: 'delete' removes the stored rows of
+        # IDs no longer in it, 'flag' sets stale_since on them, None does nothing
+        'stale_items': 'delete',
+        # Leave an object alone if more than this fraction of its stored rows would go stale
+        'max_stale_fraction': 0.5
+    },
+    'storage': {
+        # 'per_file' writes one document per (file_key, extracted_id) to 'collection';
+        # 'per_title' merges every file into one document per extracted_id in 'titles_collection'
+        'layout': 'per_file',
+        # 'full' keeps the parsed line under 'content' next to 'deeplinks' and
+        # 'additional_fields'; 'compact' stores only those two, once
+        'schema': 'full',
+        # Compact schema only: None drops the line, 'zlib' keeps it compressed in 'content_zlib'
+        'raw_content': None
+    },
+    'logging': {
+        # 'metrics' logs one-line key=value records plus periodic throughput;
+        # 'verbose' also logs every bulk batch and multi-line per-file summaries
+        'mode': 'metrics',
+        # Seconds between throughput reports
+        'progress_interval': 30,
+        # Fraction of documents logged individually (0 disables, 1 logs all)
+        'doc_sample_rate': 0.0,
+        # Fraction of malformed lines logged individually in 'metrics' mode; all are counted
+        'issue_sample_rate': 0.001
     }
 }
 
+# Content_latest_{country}_{platform}_jsonl, optionally with a compression suffix
+OBJECT_NAME_PATTERN = re.compile(r'Content_latest_([a-z]{2})_(.+?)_jsonl(?:\.[a-z]+)?$')
+
+# Fields copied from each line into 'additional_fields'
+ADDITIONAL_FIELDS = (
+    'UID', 'PlatformName', 'Title', 'CleanTitle',
+    'OriginalTitle', 'Type', 'Year', 'Duration'
+)
+
 # Existing context manager and helper functions remain the same
 @contextmanager
 def get_mongo_collection(config):
@@ -58,79 +182,1100 @@ def get_mongo_collection(config):
         if mongo_client:
             mongo_client.close()
 
-def extract_numeric_id(line):
-    """Extract first numeric ID from ExternalIds with robust error handling."""
-    try:
-        data = json.loads(line)
-        external_ids = data.get("ExternalIds", [])
+def get_json_loads(backend='auto'):
+    """Return the JSON decoding function for the configured backend."""
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'json'
 
-        if not external_ids or not isinstance(external_ids, list):
-            return None
+    if backend == 'orjson':
+        if orjson is None:
+            raise ValueError("JSON backend 'orjson' requested but orjson is not installed")
+        return orjson.loads
+    if backend == 'json':
+        return json.loads
+    raise ValueError(f"Unknown JSON backend: {backend}")
 
-        for item in external_ids:
-            if isinstance(item, dict) and "ID" in item:
-                id_value = item["ID"]
-                if isinstance(id_value, int):
-                    return id_value
-                elif isinstance(id_value, str) and id_value.isdigit():
-                    return int(id_value)
+# BSON integers are 64-bit; a larger ID fails the whole bulk_write it is sent in
+MAX_NUMERIC_ID = 2 ** 63 - 1
+
+def extract_numeric_id(data):
+    """Extract first numeric ID from ExternalIds of a parsed line.
+
+    Returns None if that ID does not fit in a BSON 64-bit integer, so the line
+    is skipped on its own instead of failing its batch.
+    """
+    external_ids = data.get("ExternalIds", [])
+
+    if not external_ids or not isinstance(external_ids, list):
         return None
 
+    for item in external_ids:
+        if isinstance(item, dict) and "ID" in item:
+            id_value = item["ID"]
+            if isinstance(id_value, str) and id_value.isdigit():
+                id_value = int(id_value)
+            elif not isinstance(id_value, int):
+                continue
+            return id_value if -MAX_NUMERIC_ID - 1 <= id_value <= MAX_NUMERIC_ID else None
+    return None
+
+def extract_deeplinks(data):
+    """Extract Deeplinks from a parsed line, or None if they are not a dictionary."""
+    deeplinks = data.get("Deeplinks", {})
+    return deeplinks if isinstance(deeplinks, dict) else None
+
+def extract_additional_fields(data):
+    """Extract additional fields from a parsed line."""
+    return {field: data.get(field) for field in ADDITIONAL_FIELDS}
+
+def compute_content_hash(data):
+    """Return a stable hash of a parsed line, independent of key order and whitespace.
+
+    The canonical form is produced by orjson when it is installed and by the json
+    module otherwise; installing or removing orjson changes the hashes once.
+    """
+    if orjson is not None:
+        canonical = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    else:
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+class DeeplinkRecord(NamedTuple):
+    """A JSONL line decoded once into everything the writer needs."""
+    line_number: int
+    extracted_id: Optional[int]
+    deeplinks: dict
+    additional_fields: dict
+    content: dict
+    content_hash: str
+    # Byte offset of the line in its object, which orders lines even when their numbers are unknown
+    offset: Optional[int] = None
+
+def note_line_issue(issues, kind, key, line_number, message, sample_rate=1.0):
+    """Count a bad line under kind in issues and log it for a sample_rate fraction of calls."""
+    if issues is not None:
+        issues[kind] = issues.get(kind, 0) + 1
+    if sample_rate and random.random() < sample_rate:
+        logger.warning(f"line_issue file_key={key} line={line_number} kind={kind} {message}")
+
+def decode_record(line, line_number, loads=json.loads, offset=None, key=None, issues=None, sample_rate=1.0):
+    """Parse a JSONL line exactly once and return a DeeplinkRecord, or None if it is malformed.
+
+    Malformed lines and lines with unusable Deeplinks are counted in the
+    issues dict under 'malformed' and 'bad_deeplinks'; only a sample_rate
+    fraction of them is logged.
+    """
+    try:
+        data = loads(line)
     except Exception as e:
-        logger.error(f"ID extraction error: {e}")
+        note_line_issue(issues, 'malformed', key, line_number, f"error={str(e)!r}", sample_rate)
         return None
 
-def extract_deeplinks(line):
-    """Extract Deeplinks from given line."""
-    try:
-        data = json.loads(line)
-        deeplinks = data.get("Deeplinks", {})
+    if not isinstance(data, dict):
+        note_line_issue(issues, 'malformed', key, line_number, "error='object expected'", sample_rate)
+        return None
+
+    deeplinks = extract_deeplinks(data)
+    if deeplinks is None:
+        note_line_issue(issues, 'bad_deeplinks', key, line_number, "error='dictionary expected'", sample_rate)
+        deeplinks = {}
+
+    return DeeplinkRecord(
+        line_number=line_number,
+        extracted_id=extract_numeric_id(data),
+        deeplinks=deeplinks,
+        additional_fields=extract_additional_fields(data),
+        content=data,
+        content_hash=compute_content_hash(data),
+        offset=offset
+    )
+
+def object_source(key):
+    """Return the dotted (country.platform) path a Spaces object's rows are merged under."""
+    match = OBJECT_NAME_PATTERN.search(key.rsplit('/', 1)[-1])
+    if match is None:
+        raise ValueError(f"{key} is not a Content_latest_{{country}}_{{platform}}_jsonl object")
+    country, platform = match.groups()
+    # Dots and a leading $ would be read as path operators
+    return f"{country}.{platform.replace('.', '_').lstrip('$')}"
+
+def get_target_collection(collection, layout='per_file'):
+    """Return the collection rows are written to for a storage layout."""
+    if layout == 'per_title':
+        return collection.database[CONFIG['mongodb']['titles_collection']]
+    if layout != 'per_file':
+        raise ValueError(f"Unknown storage layout: {layout}")
+    return collection
+
+def find_title_deeplinks(titles, extracted_id):
+    """Return the {country: {platform: deeplinks}} map of a title with a single _id lookup."""
+    document = titles.find_one({'_id': extracted_id}, {'deeplinks': 1})
+    return document['deeplinks'] if document else {}
+
+def build_upsert_filter(key, extracted_id, content_hash, layout='per_file', etag=None, offset=None):
+    """Match the stored document for (key, extracted_id) only if its content changed.
+
+    In the 'per_title' layout the document is the title's, and the check is
+    against the hash this object last merged into it.
+
+    With the line's offset, a row written from the same version (etag) of the
+    object is only replaced by a later line. An object holding an ID on
+    several lines then keeps the last one whichever write lands first, and
+    re-reading it rewrites nothing.
+    """
+    if layout == 'per_title':
+        prefix = f"sources.{object_source(key)}."
+        query = {'_id': extracted_id, f"{prefix}content_hash": {'$ne': content_hash}}
+    else:
+        prefix = 'source_'
+        query = {'file_key': key, 'extracted_id': extracted_id, 'content_hash': {'$ne': content_hash}}
+    if offset is not None:
+        query['$or'] = [{f"{prefix}etag": {'$ne': etag}}, {f"{prefix}offset": {'$lt': offset}}]
+    return query
+
+def encode_raw_content(data):
+    """Serialize a parsed line and zlib-compress it for the 'content_zlib' field."""
+    if orjson is not None:
+        raw = orjson.dumps(data)
+    else:
+        raw = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return bson.Binary(zlib.compress(raw))
 
-        if isinstance(deeplinks, dict):
-            return deeplinks
+def decode_raw_content(document):
+    """Return the parsed line of a stored document in either schema, or None if it was dropped."""
+    if 'content' in document:
+        return document['content']
+    if document.get('content_zlib') is not None:
+        return json.loads(zlib.decompress(document['content_zlib']))
+    return None
+
+def build_content_fields(content, schema='full', raw_content=None):
+    """Return the ($set, $unset) parts that store a parsed line under the given schema.
+
+    Fields of the other schema are unset so switching schemas never leaves a
+    stale copy of the line behind.
+    """
+    if schema == 'full':
+        return {'content': content}, {'content_zlib': ''}
+    if schema != 'compact':
+        raise ValueError(f"Unknown storage schema: {schema}")
+    if raw_content == 'zlib':
+        return {'content_zlib': encode_raw_content(content)}, {'content': ''}
+    if raw_content is None:
+        return {}, {'content': '', 'content_zlib': ''}
+    raise ValueError(f"Unknown raw content mode: {raw_content}")
+
+def stored_content_hash(content_hash, schema='full', raw_content=None, layout='per_file'):
+    """Return the content_hash a row is stored with under the given storage settings.
+
+    The change check only compares hashes, so the compact schemas tag the hash
+    with their settings: a row stored under another schema then never looks
+    unchanged, and a schema switch rewrites it. The full schema keeps the plain
+    hash, so rows written before the tag existed stay unchanged. Title
+    documents do not depend on the schema and keep the plain hash too.
+    """
+    if schema == 'full' or layout == 'per_title':
+        return content_hash
+    return f"{content_hash}:{schema}:{raw_content or 'none'}"
+
+def build_title_update(key, record, processed_at, etag=None):
+    """Return the $set update that merges a record into its title document.
+
+    Each object only writes below its own country.platform path, so files are
+    merged by concurrent blind upserts without reading the document first.
+    Two objects inserting a new title at once collide on _id; the writer
+    retries the loser, which then updates the winner's document.
+    """
+    source = object_source(key)
+    return {
+        '$set': {
+            'extracted_id': record.extracted_id,
+            'additional_fields': record.additional_fields,
+            'processed_at': processed_at,
+            f"deeplinks.{source}": record.deeplinks,
+            f"sources.{source}": {
+                'file_key': key,
+                'line_number': record.line_number,
+                'etag': etag,
+                'offset': record.offset,
+                'content_hash': record.content_hash,
+                'processed_at': processed_at
+            }
+        },
+        # Indexed list of the sources merged in, for stale item reconciliation
+        '$addToSet': {'object_sources': source}
+    }
+
+def build_upsert_update(key, record, processed_at, schema='full', raw_content=None, layout='per_file', etag=None):
+    """Return the $set/$unset update that stores a record of the given object version."""
+    if layout == 'per_title':
+        return build_title_update(key, record, processed_at, etag)
+    content_set, content_unset = build_content_fields(record.content, schema, raw_content)
+    return {
+        '$set': {
+            'file_key': key,
+            'line_number': record.line_number,
+            'source_etag': etag,
+            'source_offset': record.offset,
+            'extracted_id': record.extracted_id,
+            'content_hash': stored_content_hash(record.content_hash, schema, raw_content),
+            'deeplinks': record.deeplinks,
+            'additional_fields': record.additional_fields,
+            'processed_at': processed_at,
+            **content_set
+        },
+        '$unset': content_unset
+    }
+
+def build_upsert(key, record, processed_at, schema='full', raw_content=None, layout='per_file', etag=None):
+    """Build the conditional upsert for a record.
+
+    The change check lives in the filter, so there is no read round trip: if the
+    stored document already carries the same content_hash, the filter does not
+    match, the upsert collides with the unique index and the bulk writer counts
+    it as unchanged. processed_at therefore records when the row last changed.
+    """
+    content_hash = stored_content_hash(record.content_hash, schema, raw_content, layout)
+    return UpdateOne(
+        build_upsert_filter(key, record.extracted_id, content_hash, layout, etag, record.offset),
+        build_upsert_update(key, record, processed_at, schema, raw_content, layout, etag),
+        upsert=True
+    )
+
+def log_sampled_document(key, record, sample_rate):
+    """Log a one-line view of a document for a sample_rate fraction of calls."""
+    if sample_rate and random.random() < sample_rate:
+        fields = record.additional_fields
+        logger.info(
+            f"doc file_key={key} extracted_id={record.extracted_id} line={record.line_number} "
+            f"platform={fields.get('PlatformName')!r} title={fields.get('Title')!r} "
+            f"deeplinks={len(record.deeplinks)}"
+        )
+
+# Wanted-ID filter of this process, set by load_wanted_ids
+WANTED_IDS = None
+
+def load_wanted_ids(path):
+    """Load the wanted-ID Bloom filter for this process; also the process pool initializer."""
+    global WANTED_IDS
+    WANTED_IDS = BloomFilter.load(path) if path else None
+
+def iter_block_lines(block, first_line, offset=0):
+    """Yield (line_number, line_offset, line) for the non-blank raw lines of a block starting at byte offset.
+
+    first_line is None for blocks read out of order, whose line numbers are unknown.
+    """
+    line_numbers = itertools.repeat(None) if first_line is None else itertools.count(first_line)
+    for line_num, line in zip(line_numbers, block.split(b'\n')):
+        if line.strip():
+            yield line_num, offset, line
+        offset += len(line) + 1
+
+def latest_records(records):
+    """Keep the last of the records sharing an extracted_id, as sequential writes of them would."""
+    latest = {}
+    for record in records:
+        latest[record.extracted_id] = record
+    return latest.values()
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def parse_block(key, block, first_line, processed_at, json_backend, doc_sample_rate=0.0,
+                schema='full', raw_content=None, layout='per_file', etag=None, offset=0, issue_sample_rate=1.0):
+    """Process-pool worker: decode a block of complete raw lines.
+
+    Returns (line_count, issues, payloads, peak_rss) where issues counts the
+    malformed lines by kind and each payload is a compact
+    (extracted_id, content_hash, offset, update_bson) tuple, one per
+    extracted_id of the block. The update is BSON-encoded
+    in the worker, so only bytes are pickled back instead of nested dicts.
+    peak_rss is the worker's peak memory so far in MB; the workers are not
+    children of the ingester, so it cannot be read from outside.
+    """
+    loads = get_json_loads(json_backend)
+    records = []
+    payloads = []
+    issues = {}
+    line_count = 0
+
+    for line_num, line_offset, line in iter_block_lines(block, first_line, offset):
+        line_count += 1
+        if WANTED_IDS is not None and not may_be_wanted(WANTED_IDS, line):
+            continue
+
+        record = decode_record(line, line_num, loads, line_offset, key, issues, issue_sample_rate)
+        if record is None:
+            continue
+
+        if record.extracted_id and record.deeplinks:
+            log_sampled_document(key, record, doc_sample_rate)
+            records.append(record)
+
+    for record in latest_records(records):
+        try:
+            update_bson = bson.encode(build_upsert_update(key, record, processed_at, schema, raw_content, layout, etag))
+        except Exception as e:
+            logger.error(f"BSON encode error at line {record.line_number}: {e}")
+            continue
+        content_hash = stored_content_hash(record.content_hash, schema, raw_content, layout)
+        payloads.append((record.extracted_id, content_hash, record.offset, update_bson))
+
+    return line_count, issues, payloads, peak_rss_mb()
+
+def storage_signature(storage):
+    """Return the storage settings that decide where and how an object's rows are written."""
+    return {
+        'layout': storage['layout'],
+        'schema': storage['schema'],
+        'raw_content': storage['raw_content']
+    }
+
+def load_manifest(manifest, prefix):
+    """Return the sync manifest entries under prefix as {object_key: entry}."""
+    entries = manifest.find(
+        {'_id': {'$regex': f"^{re.escape(prefix)}"}},
+        {'etag': 1, 'size': 1, 'storage': 1, 'checkpoint': 1}
+    )
+    return {entry['_id']: entry for entry in entries}
+
+def object_changed(obj, entry, storage):
+    """Tell whether a listed object is new or differs from its manifest entry.
+
+    An object ingested under other storage settings counts as changed: its
+    rows are in another collection or shape, so it must be written again.
+    """
+    return (
+        entry is None
+        or entry.get('etag') != obj.get('ETag')
+        or entry.get('size') != obj.get('Size')
+        or entry.get('storage') != storage_signature(storage)
+    )
+
+def resume_checkpoint(obj, entry, storage):
+    """Return the checkpoint of a partially ingested object if it still matches the listed ETag and storage."""
+    checkpoint = (entry or {}).get('checkpoint')
+    if (checkpoint and checkpoint.get('etag') == obj.get('ETag')
+            and checkpoint.get('storage') == storage_signature(storage)):
+        return checkpoint
+    return None
+
+def record_checkpoint(manifest, obj, offset, line, storage):
+    """Store how far into an object every line has been committed, and under which storage settings."""
+    manifest.update_one(
+        {'_id': obj['Key']},
+        {'$set': {'checkpoint': {
+            'etag': obj.get('ETag'),
+            'offset': offset,
+            'line': line,
+            'storage': storage_signature(storage),
+            'updated_at': datetime.utcnow()
+        }}},
+        upsert=True
+    )
+
+def record_manifest_entry(manifest, obj, storage, shard=None):
+    """Store the ETag, size and storage settings of a fully ingested object, and the shard that ingested it."""
+    manifest.update_one(
+        {'_id': obj['Key']},
+        {
+            '$set': {
+                'etag': obj.get('ETag'),
+                'size': obj.get('Size'),
+                'storage': storage_signature(storage),
+                'last_modified': obj.get('LastModified'),
+                'processed_at': datetime.utcnow(),
+                'shard': format_shard(shard) if shard else None
+            },
+            '$unset': {'checkpoint': ''}
+        },
+        upsert=True
+    )
+
+def iter_stale_ids(stored, seen):
+    """Merge a sorted stream of stored (extracted_id, flagged) pairs against the sorted IDs seen.
+
+    Yields (extracted_id, present, flagged) for the stored IDs missing from
+    seen and for the flagged ones, the only rows reconciliation may touch.
+    """
+    seen = iter(seen)
+    current = next(seen, None)
+    for extracted_id, flagged in stored:
+        while current is not None and current < extracted_id:
+            current = next(seen, None)
+        present = current == extracted_id
+        if not present or flagged:
+            yield extracted_id, present, flagged
+
+def _has_path(document, path):
+    """Tell whether a dotted path exists in a (projected) document."""
+    *parents, field = path.split('.')
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return False
+    return field in document
+
+def reconcile_object(collection, key, seen_ids, mode='delete', batch_size=1000, max_stale_fraction=0.5,
+                     layout='per_file'):
+    """Remove or flag the rows of key whose extracted_id is not in seen_ids.
+
+    Stored IDs come from a projection-only cursor over the (file_key,
+    extracted_id) index in ID order and are diffed against the sorted seen
+    IDs without loading the stored set. Returns the number of stale rows
+    acted on, or None if the stale fraction was too high to trust.
+
+    In the 'per_title' layout the rows are the titles listing the object's
+    source in object_sources. A stale title loses that source's deeplinks
+    and sources entries, and is deleted once no source is left; flagging
+    sets stale_since under its sources entry.
+    """
+    seen = sorted(set(seen_ids))
+    if layout == 'per_title':
+        source = object_source(key)
+        query = {'object_sources': source}
+        id_field = '_id'
+        flag_field = f"sources.{source}.stale_since"
+    else:
+        query = {'file_key': key, 'extracted_id': {'$type': 'number'}}
+        id_field = 'extracted_id'
+        flag_field = 'stale_since'
+    cursor = collection.find(
+        query,
+        {'_id': 0, id_field: 1, flag_field: 1} if id_field != '_id' else {flag_field: 1},
+        batch_size=batch_size
+    ).sort(id_field, pymongo.ASCENDING)
+
+    stored = ((document[id_field], _has_path(document, flag_field)) for document in cursor)
+    stale, returned = array('q'), array('q')
+    for extracted_id, present, flagged in iter_stale_ids(stored, seen):
+        if present:
+            returned.append(extracted_id)
+        elif not (flagged and mode == 'flag'):
+            stale.append(extracted_id)
+
+    stored_count = collection.count_documents(query) if stale else 0
+    if stale and len(stale) > max_stale_fraction * stored_count:
+        logger.warning(
+            f"stale key={key} stale={len(stale)} stored={stored_count} "
+            f"status=refused max_fraction={max_stale_fraction}"
+        )
+        return None
+
+    now = datetime.utcnow()
+    for start in range(0, len(stale), batch_size):
+        ids = list(stale[start:start + batch_size])
+        batch = {**query, id_field: {'$in': ids}}
+        if mode != 'delete':
+            collection.update_many(batch, {'$set': {flag_field: now}})
+        elif layout == 'per_title':
+            collection.update_many(batch, {
+                '$unset': {f"deeplinks.{source}": '', f"sources.{source}": ''},
+                '$pull': {'object_sources': source}
+            })
+            collection.delete_many({'_id': {'$in': ids}, 'object_sources': {'$size': 0}})
         else:
-            logger.warning("Unexpected Deeplinks format, dictionary expected.")
-            return {}
-    except Exception as e:
-        logger.error(f"Deeplink extraction error: {e}")
-        return {}
+            collection.delete_many(batch)
+    for start in range(0, len(returned), batch_size):
+        collection.update_many(
+            {**query, id_field: {'$in': list(returned[start:start + batch_size])}},
+            {'$unset': {flag_field: ''}}
+        )
+    return len(stale)
 
-def extract_additional_fields(line):
-    """Extract additional fields from JSON line."""
+def parse_shard(value):
+    """Parse an 'index/count' shard spec with 0 <= index < count."""
     try:
-        data = json.loads(line)
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard must look like index/count, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}), got {value!r}")
+    return index, count
+
+def format_shard(shard):
+    return f"{shard[0]}/{shard[1]}"
+
+def shard_by_hash(key, count):
+    """Return the shard of an object key; stable across processes, unlike hash()."""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+def shard_by_size(objects, count):
+    """Assign listed objects to shards, largest first onto the least loaded shard.
+
+    Returns {key: shard}. Ties are broken by key and shard index, so every
+    worker computes the same assignment from the same listing.
+    """
+    loads = [(0, shard) for shard in range(count)]
+    assignment = {}
+    for obj in sorted(objects, key=lambda obj: (-obj.get('Size', 0), obj['Key'])):
+        load, shard = heapq.heappop(loads)
+        assignment[obj['Key']] = shard
+        heapq.heappush(loads, (load + obj.get('Size', 0), shard))
+    return assignment
+
+def select_shard(objects, shard, strategy='hash'):
+    """Yield the listed objects that belong to shard (index, count)."""
+    index, count = shard
+    if strategy == 'hash':
+        return (obj for obj in objects if shard_by_hash(obj['Key'], count) == index)
+    if strategy == 'size':
+        # Needs the whole listing before the first object can be assigned
+        objects = list(objects)
+        assignment = shard_by_size(objects, count)
+        return (obj for obj in objects if assignment[obj['Key']] == index)
+    raise ValueError(f"Unknown shard strategy: {strategy}")
+
+class ProgressReporter:
+    """Thread-safe ingest counters with a throughput report every interval seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = Lock()
+        self.started_at = self.reported_at = time.monotonic()
+        self.counters = {
+            'lines': 0,
+            'bytes': 0,
+            'upserted': 0,
+            'modified': 0,
+            'unchanged': 0,
+            'objects': 0,
+            'object_seconds': 0.0,
+            # Busy time summed over the threads of each pipeline stage
+            'download_seconds': 0.0,
+            'parse_seconds': 0.0,
+            'write_seconds': 0.0
+        }
+        self.reported = dict(self.counters)
+
+    def add(self, **counts):
+        """Add to the counters and log throughput if the interval elapsed."""
+        with self.lock:
+            for field, value in counts.items():
+                self.counters[field] += value
+
+            now = time.monotonic()
+            if now - self.reported_at < self.interval:
+                return
+            report = self._format(now - self.reported_at, self.reported)
+            self.reported_at = now
+            self.reported = dict(self.counters)
+        logger.info(f"progress {report}")
+
+    def summary(self):
+        """Throughput over the whole run."""
+        with self.lock:
+            return self._format(time.monotonic() - self.started_at, dict.fromkeys(self.counters, 0))
+
+    def _format(self, elapsed, since):
+        delta = {field: self.counters[field] - since[field] for field in self.counters}
+        elapsed = max(elapsed, 1e-9)
+        avg_object = delta['object_seconds'] / delta['objects'] if delta['objects'] else 0.0
+        return (
+            f"lines={self.counters['lines']} "
+            f"objects={self.counters['objects']} "
+            f"lines_per_s={delta['lines'] / elapsed:.0f} "
+            f"mb_per_s={delta['bytes'] / elapsed / 1024 / 1024:.2f} "
+            f"upserts_per_s={(delta['upserted'] + delta['modified']) / elapsed:.0f} "
+            f"unchanged_per_s={delta['unchanged'] / elapsed:.0f} "
+            f"avg_object_s={avg_object:.2f}"
+        )
+
+class ObjectTask:
+    """Progress of one Spaces object through the ingest pipeline.
+
+    Chunks are written out of order, so the task keeps the byte spans of the
+    written chunks and advances committed_offset (and committed_line) only
+    across a contiguous prefix of the object. That prefix is what checkpoints
+    record and what a resumed run skips with a ranged GET.
+    """
+
+    def __init__(self, obj, checkpoint=None):
+        self.obj = obj
+        self.key = obj['Key']
+        self.processed_at = datetime.utcnow()
+        self.started_at = time.monotonic()
+        self.lock = Lock()
+        self.checkpoint_lock = Lock()
+        self.chunk_count = None
+        self.chunks_written = 0
+        self.failed = False
+        self.resume_offset = checkpoint['offset'] if checkpoint else 0
+        self.resume_line = checkpoint.get('line') if checkpoint else 1
+        self.committed_offset = self.resume_offset
+        self.committed_line = self.resume_line
+        self.checkpointed_offset = self.resume_offset
+        self.written_spans = {}
+        # extracted_id of every row written, for stale detection; None once it cannot be trusted
+        self.seen_ids = array('q') if not self.resume_offset else None
+        self.totals = {
+            'lines': 0,
+            'bytes': 0,
+            'upserted': 0,
+            'modified': 0,
+            'skipped': 0,
+            'errors': 0,
+            'malformed': 0,
+            'bad_deeplinks': 0
+        }
+
+    def set_chunk_count(self, chunk_count):
+        """Called by the downloader before it queues the last chunk of the object."""
+        with self.lock:
+            self.chunk_count = chunk_count
+
+    def add_seen_ids(self, ids):
+        """Record the extracted_ids of a parsed chunk."""
+        with self.lock:
+            if self.seen_ids is None:
+                return
+            try:
+                self.seen_ids.extend(ids)
+            except OverflowError:
+                # An ID beyond 64 bits; stale detection is skipped for this object
+                self.seen_ids = None
+
+    def chunk_written(self, totals, span=None):
+        """Add the counts of a written chunk and, if it fully committed, its (start, end, next_line) span.
+
+        Returns (complete, advanced): whether it was the object's last chunk and
+        whether the committed prefix grew.
+        """
+        with self.lock:
+            for field, value in totals.items():
+                self.totals[field] += value
+            self.chunks_written += 1
+
+            advanced = False
+            if span is not None:
+                start, end, next_line = span
+                self.written_spans[start] = (end, next_line)
+                while self.committed_offset in self.written_spans:
+                    self.committed_offset, self.committed_line = self.written_spans.pop(self.committed_offset)
+                    advanced = True
+
+            complete = self.chunk_count is not None and self.chunks_written == self.chunk_count
+            return complete, advanced
+
+class IngestPipeline:
+    """Download, parse and write stages connected by bounded queues.
+
+    Downloaders stream objects into chunks of lines, parsers turn chunks into
+    UpdateOne operations and writers, each with its own MongoDB connection,
+    send them with bulk_write. A full queue blocks the stage feeding it, so a
+    slow stage throttles the others instead of letting work pile up in memory.
+    """
+
+    def __init__(self, s3_client, loads, metrics, settings, progress, limiter=None):
+        self.s3_client = s3_client
+        self.limiter = limiter
+        self.progress = progress
+        self.loads = loads
+        self.process_pool = None
+        self.metrics = metrics
+        self.metrics_lock = Lock()
+        self.settings = settings
+        self.object_queue = Queue(maxsize=settings['downloaders'] * 2)
+        self.parse_queue = Queue(maxsize=settings['queue_size'])
+        self.write_queue = Queue(maxsize=settings['queue_size'])
+
+    def run(self, objects):
+        """Push every listed object through the pipeline and wait for all stages to drain."""
+        if self.settings['parse_mode'] == 'processes':
+            # Workers are started on the first submit, once the stage threads run;
+            # forking then would copy locks those threads hold, so start them clean
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.settings['parsers'],
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=load_wanted_ids,
+                initargs=(self.settings['id_filter'],)
+            )
+
+        downloaders = self._start(self.settings['downloaders'], self._download_worker, 'downloader')
+        parsers = self._start(self.settings['parsers'], self._parse_worker, 'parser')
+        writers = self._start(self.settings['writers'], self._write_worker, 'writer')
+        try:
+            for obj, checkpoint in objects:
+                self.object_queue.put(ObjectTask(obj, checkpoint))
+        finally:
+            self._stop(self.object_queue, downloaders)
+            self._stop(self.parse_queue, parsers)
+            self._stop(self.write_queue, writers)
+            if self.process_pool is not None:
+                self.process_pool.shutdown()
+
+    def _start(self, count, target, name):
+        threads = [Thread(target=target, name=f"{name}-{i}", daemon=True) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _stop(self, source, threads):
+        for _ in threads:
+            source.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _read_options(self, task):
+        """Fetch objects of at least ranged_threshold bytes as parallel byte ranges."""
+        size = task.obj.get('Size')
+        ranged = size is not None and size >= self.settings['ranged_threshold']
         return {
-            'UID': data.get('UID'),
-            'PlatformName': data.get('PlatformName'),
-            'Title': data.get('Title'),
-            'CleanTitle': data.get('CleanTitle'),
-            'OriginalTitle': data.get('OriginalTitle'),
-            'Type': data.get('Type'),
-            'Year': data.get('Year'),
-            'Duration': data.get('Duration')
+            'size': size,
+            'range_size': self.settings['range_size'],
+            'range_workers': self.settings['range_workers'] if ranged else 0,
+            'start': task.resume_offset,
+            'limiter': self.limiter
         }
-    except Exception as e:
-        logger.error(f"Additional fields extraction error: {e}")
-        return {}
-
-def process_do_spaces_files():
-    """Process DigitalOcean Spaces files and store in MongoDB."""
-    # Initialize DO Spaces client
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=CONFIG['do_spaces']['access_key'],
-        aws_secret_access_key=CONFIG['do_spaces']['secret_key'],
-        endpoint_url=CONFIG['do_spaces']['endpoint'],
-        config=Config(signature_version='s3v4'),
-        region_name='nyc3'
+
+    def _read_chunks(self, task):
+        """Yield (first_line, offset, block) chunks of complete lines, starting at the task's resume point."""
+        bucket = CONFIG['do_spaces']['bucket']
+        read_options = self._read_options(task)
+
+        # Compressed objects can only be decompressed front to back
+        unordered = self.settings['ranged_unordered'] and compression_from_key(task.key) is None
+        if read_options['range_workers'] and unordered:
+            blocks = iter_object_range_blocks(
+                self.s3_client,
+                bucket,
+                task.key,
+                read_options['size'],
+                read_options['range_size'],
+                read_options['range_workers'],
+                start=read_options['start'],
+                limiter=self.limiter
+            )
+            for offset, block in blocks:
+                yield None, offset, block
+            return
+
+        # A checkpoint written by an unordered run has no line number to resume from
+        lines_known = task.resume_line is not None
+        blocks = iter_object_line_blocks(
+            self.s3_client,
+            bucket,
+            task.key,
+            chunk_size=self.settings['read_chunk_size'],
+            first_line=task.resume_line if lines_known else 1,
+            **read_options
+        )
+        offset = task.resume_offset
+        for first_line, block in blocks:
+            yield first_line if lines_known else None, offset, block
+            offset += len(block)
+
+    def _download_worker(self):
+        while True:
+            task = self.object_queue.get()
+            if task is None:
+                break
+
+            chunk_count = 0
+            try:
+                started = time.monotonic()
+                for chunk in self._read_chunks(task):
+                    self.progress.add(download_seconds=time.monotonic() - started)
+                    self.parse_queue.put((task, chunk))
+                    chunk_count += 1
+                    started = time.monotonic()
+            except Exception as e:
+                logger.error(f"File download error {task.key}: {e}")
+                task.failed = True
+
+            # Always queue a final empty chunk so a writer finishes the object
+            task.set_chunk_count(chunk_count + 1)
+            self.parse_queue.put((task, None))
+
+    def _parse_worker(self):
+        while True:
+            item = self.parse_queue.get()
+            if item is None:
+                break
+
+            task, chunk = item
+            operations = []
+            counts = {'lines': 0, 'bytes': 0}
+            span = None
+            if chunk is not None:
+                first_line, offset, block = chunk
+                started = time.monotonic()
+                try:
+                    if self.process_pool is not None:
+                        operations, counts['lines'], issues = self._parse_in_process(task, first_line, offset, block)
+                    else:
+                        operations, counts['lines'], issues = self._parse_in_thread(task, first_line, offset, block)
+                    counts.update(issues)
+                    counts['bytes'] = len(block)
+                    next_line = None if first_line is None else first_line + block.count(b'\n')
+                    span = (offset, offset + len(block), next_line)
+                except Exception as e:
+                    logger.error(f"Parse error {task.key}: {e}")
+                    task.failed = True
+                    operations = []
+                self.progress.add(parse_seconds=time.monotonic() - started)
+
+            self.write_queue.put((task, span, operations, counts))
+
+    def _issue_sample_rate(self):
+        """Fraction of malformed lines logged individually: all of them in 'verbose' mode."""
+        return 1.0 if CONFIG['logging']['mode'] == 'verbose' else CONFIG['logging']['issue_sample_rate']
+
+    def _parse_in_thread(self, task, first_line, offset, block):
+        """Decode a raw block in the calling thread into upserts, one per extracted_id."""
+        records = []
+        issues = {}
+        line_count = 0
+        sample_rate = self._issue_sample_rate()
+        for line_num, line_offset, line in iter_block_lines(block, first_line, offset):
+            line_count += 1
+            if WANTED_IDS is not None and not may_be_wanted(WANTED_IDS, line):
+                continue
+
+            record = decode_record(line, line_num, self.loads, line_offset, task.key, issues, sample_rate)
+            if record is None:
+                continue
+
+            if record.extracted_id and record.deeplinks:
+                log_sampled_document(task.key, record, CONFIG['logging']['doc_sample_rate'])
+                records.append(record)
+
+        operations = []
+        ids = []
+        for record in latest_records(records):
+            ids.append(record.extracted_id)
+            operations.append(build_upsert(
+                task.key,
+                record,
+                task.processed_at,
+                CONFIG['storage']['schema'],
+                CONFIG['storage']['raw_content'],
+                CONFIG['storage']['layout'],
+                task.obj.get('ETag')
+            ))
+        task.add_seen_ids(ids)
+        return operations, line_count, issues
+
+    def _parse_in_process(self, task, first_line, offset, block):
+        """Decode a raw block in the process pool and rebuild the upserts from its payloads."""
+        line_count, issues, payloads, worker_rss = self.process_pool.submit(
+            parse_block,
+            task.key,
+            block,
+            first_line,
+            task.processed_at,
+            self.settings['json_backend'],
+            CONFIG['logging']['doc_sample_rate'],
+            CONFIG['storage']['schema'],
+            CONFIG['storage']['raw_content'],
+            CONFIG['storage']['layout'],
+            task.obj.get('ETag'),
+            offset,
+            self._issue_sample_rate()
+        ).result()
+        if worker_rss is not None:
+            with self.metrics_lock:
+                self.metrics['parse_worker_peak_rss_mb'] = max(self.metrics['parse_worker_peak_rss_mb'], worker_rss)
+
+        operations = [
+            UpdateOne(
+                build_upsert_filter(
+                    task.key, extracted_id, content_hash, CONFIG['storage']['layout'], task.obj.get('ETag'), line_offset
+                ),
+                RawBSONDocument(update_bson),
+                upsert=True
+            )
+            for extracted_id, content_hash, line_offset, update_bson in payloads
+        ]
+        task.add_seen_ids(extracted_id for extracted_id, _, _, _ in payloads)
+        return operations, line_count, issues
+
+    def _write_worker(self):
+        with get_mongo_collection(CONFIG['mongodb']) as collection:
+            if collection is None:
+                logger.error("Writer could not get MongoDB collection.")
+            manifest = None if collection is None else collection.database[CONFIG['mongodb']['manifest_collection']]
+            target = None if collection is None else get_target_collection(collection, CONFIG['storage']['layout'])
+
+            while True:
+                item = self.write_queue.get()
+                if item is None:
+                    break
+
+                task, span, operations, counts = item
+                totals = dict(counts)
+                started = time.monotonic()
+                try:
+                    if collection is None:
+                        raise RuntimeError("no MongoDB connection")
+                    with BulkUpsertWriter(
+                        target,
+                        self.settings['batch_size'],
+                        label=task.key,
+                        log_level=logging.INFO if CONFIG['logging']['mode'] == 'verbose' else logging.DEBUG,
+                        # Objects of one title race to insert its document; the losers retry as updates
+                        retry_duplicates=CONFIG['storage']['layout'] == 'per_title'
+                    ) as writer:
+                        for operation in operations:
+                            writer.add(operation)
+                    for field in ('upserted', 'modified', 'skipped', 'errors'):
+                        totals[field] = writer.totals[field]
+                except Exception as e:
+                    logger.error(f"MongoDB write error {task.key}: {e}")
+                    task.failed = True
+
+                # Only a chunk whose every batch committed may move the checkpoint forward
+                committed = not task.failed and not totals.get('errors')
+                complete, advanced = task.chunk_written(totals, span if committed else None)
+                self.progress.add(
+                    lines=totals['lines'],
+                    bytes=totals['bytes'],
+                    upserted=totals.get('upserted', 0),
+                    modified=totals.get('modified', 0),
+                    unchanged=totals.get('skipped', 0),
+                    write_seconds=time.monotonic() - started
+                )
+                if complete:
+                    self._finish(task, manifest, target)
+                elif advanced and self.settings['checkpoints']:
+                    self._checkpoint(task, manifest)
+
+    def _reconcile(self, task, collection):
+        """Remove or flag the stored rows of IDs missing from a complete object.
+
+        Only whole objects are reconciled: a resumed run has not seen the IDs
+        before its checkpoint.
+        """
+        mode = self.settings['stale_items']
+        if not mode or task.seen_ids is None:
+            return None
+        try:
+            return reconcile_object(
+                collection,
+                task.key,
+                task.seen_ids,
+                mode,
+                self.settings['batch_size'],
+                self.settings['max_stale_fraction'],
+                CONFIG['storage']['layout']
+            )
+        except Exception as e:
+            logger.error(f"Stale item reconciliation error {task.key}: {e}")
+            return None
+
+    def _checkpoint(self, task, manifest):
+        """Persist the committed prefix of an object so a restart can resume after it."""
+        with task.checkpoint_lock:
+            with task.lock:
+                offset, line = task.committed_offset, task.committed_line
+            if offset <= task.checkpointed_offset:
+                return
+            try:
+                record_checkpoint(manifest, task.obj, offset, line, CONFIG['storage'])
+                task.checkpointed_offset = offset
+            except Exception as e:
+                logger.error(f"Checkpoint update error {task.key}: {e}")
+
+    def _finish(self, task, manifest, collection):
+        """Account for a fully written object, drop its stale rows and record it in the manifest."""
+        totals = task.totals
+        # Leave objects with failed writes out of the manifest so the next run retries them
+        failed = task.failed or totals['errors'] > 0
+        stale = self._reconcile(task, collection) if not failed else None
+        if not failed:
+            try:
+                record_manifest_entry(manifest, task.obj, CONFIG['storage'], self.settings['shard'])
+            except Exception as e:
+                logger.error(f"Manifest update error {task.key}: {e}")
+                failed = True
+
+        with self.metrics_lock:
+            self.metrics['total_lines'] += totals['lines']
+            if task.resume_offset:
+                self.metrics['resumed_files'] += 1
+            self.metrics['upserted_lines'] += totals['upserted']
+            self.metrics['modified_lines'] += totals['modified']
+            self.metrics['changed_lines'] += totals['upserted'] + totals['modified']
+            self.metrics['unchanged_lines'] += totals['skipped']
+            self.metrics['stale_lines'] += stale or 0
+            self.metrics['malformed_lines'] += totals['malformed']
+            self.metrics['bad_deeplink_lines'] += totals['bad_deeplinks']
+            if failed:
+                self.metrics['error_files'].append(task.key)
+            else:
+                self.metrics['processed_files'] += 1
+
+        elapsed = time.monotonic() - task.started_at
+        self.progress.add(objects=1, object_seconds=elapsed)
+
+        # Log file processing results
+        if CONFIG['logging']['mode'] == 'verbose':
+            logger.info(
+                f"File processed: {task.key} in {elapsed:.1f}s"
+                f"{f' (resumed at byte {task.resume_offset})' if task.resume_offset else ''}\n"
+                f"  Processed lines: {totals['lines']}\n"
+                f"  Upserted lines: {totals['upserted']}\n"
+                f"  Modified lines: {totals['modified']}\n"
+                f"  Unchanged lines: {totals['skipped']}\n"
+                f"  Malformed lines: {totals['malformed']}\n"
+                f"  Bad deeplink lines: {totals['bad_deeplinks']}"
+            )
+        else:
+            logger.info(
+                f"object key={task.key} status={'error' if failed else 'ok'} "
+                f"lines={totals['lines']} bytes={totals['bytes']} "
+                f"upserted={totals['upserted']} modified={totals['modified']} "
+                f"unchanged={totals['skipped']} stale={stale} malformed={totals['malformed']} "
+                f"bad_deeplinks={totals['bad_deeplinks']} seconds={elapsed:.2f} "
+                f"resumed_at={task.resume_offset}"
+            )
+
+def process_do_spaces_files(full_refresh=False):
+    """Process DigitalOcean Spaces files and store in MongoDB.
+
+    Objects whose ETag and size match the sync manifest are skipped unless
+    full_refresh is set. The remaining ones go through the IngestPipeline,
+    resuming after the last checkpoint of an interrupted run when the ETag
+    is unchanged. With processing.shard set, only that shard's objects are
+    listed for ingest, so workers can split a run without coordinating.
+    Returns the run metrics.
+    """
+    # Initialize DO Spaces client, with a connection for every GET the limiter and downloaders can have open
+    spaces_requests = CONFIG['processing']['spaces_requests']
+    limiter = AimdLimiter(spaces_requests['initial'], spaces_requests['minimum'], spaces_requests['maximum'])
+    s3_client = create_spaces_client(
+        CONFIG['do_spaces'],
+        max_pool_connections=spaces_requests['maximum'] + CONFIG['processing']['downloaders'],
+        limiter=limiter
     )
 
+    loads = get_json_loads(CONFIG['processing']['json_backend'])
+    load_wanted_ids(CONFIG['processing']['id_filter'])
+    shard = CONFIG['processing']['shard']
+    progress = ProgressReporter(CONFIG['logging']['progress_interval'])
+
     # Processing metrics
     metrics = {
         'total_files': 0,
         'processed_files': 0,
+        'unchanged_files': 0,
+        'resumed_files': 0,
         'total_lines': 0,
-        'inserted_lines': 0,
+        'changed_lines': 0,
+        'unchanged_lines': 0,
+        'upserted_lines': 0,
+        'modified_lines': 0,
+        'stale_lines': 0,
+        'malformed_lines': 0,
+        'bad_deeplink_lines': 0,
+        'parse_worker_peak_rss_mb': 0.0,
         'error_files': []
     }
 
@@ -145,119 +1290,61 @@ def process_do_spaces_files():
         with get_mongo_collection(CONFIG['mongodb']) as collection:
             if collection is None:
                 logger.error("Could not get MongoDB collection. Aborting processing.")
-                return
+                return metrics
+
+            try:
+                if CONFIG['storage']['layout'] == 'per_file':
+                    bootstrap_indexes(collection, min_documents=CONFIG['mongodb']['plan_check_min_documents'])
+                else:
+                    bootstrap_indexes(
+                        get_target_collection(collection, 'per_title'),
+                        TITLE_INDEXES,
+                        TITLE_QUERIES,
+                        CONFIG['mongodb']['plan_check_min_documents']
+                    )
+            except IndexBootstrapError as e:
+                logger.error(f"{e}. Aborting processing.")
+                return metrics
 
-            for page in pages:
-                for obj in page.get('Contents', []):
-                    key = obj['Key']
+            manifest = collection.database[CONFIG['mongodb']['manifest_collection']]
+            known_objects = {} if full_refresh else load_manifest(manifest, CONFIG['do_spaces']['prefix'])
+
+            listed = (obj for page in pages for obj in page.get('Contents', []))
+            if shard:
+                listed = select_shard(listed, shard, CONFIG['processing']['shard_strategy'])
+
+            def changed_objects():
+                for obj in listed:
                     metrics['total_files'] += 1
 
-                    try:
-                        # Read and process file
-                        file_obj = s3_client.get_object(
-                            Bucket=CONFIG['do_spaces']['bucket'],
-                            Key=key
-                        )
-
-                        file_content = file_obj['Body'].read().decode('utf-8')
-                        lines = file_content.splitlines()
-
-                        file_metrics = {
-                            'processed_lines': 0,
-                            'inserted_lines': 0
-                        }
-
-                        for line_num, line in enumerate(lines, 1):
-                            if not line.strip():
-                                continue
-
-                            metrics['total_lines'] += 1
-                            file_metrics['processed_lines'] += 1
-
-                            extracted_id = extract_numeric_id(line)
-                            deeplinks = extract_deeplinks(line)
-                            additional_fields = extract_additional_fields(line)
-
-                            if extracted_id and deeplinks:
-                                try:
-                                    doc = {
-                                        'file_key': key,
-                                        'line_number': line_num,
-                                        'extracted_id': extracted_id,
-                                        'content': json.loads(line),
-                                        'deeplinks': deeplinks,
-                                        'additional_fields': additional_fields,
-                                        'processed_at': datetime.utcnow()
-                                    }
-
-                                    # Check if document exists
-                                    existing_doc = collection.find_one({
-                                        'file_key': key,
-                                        'extracted_id': extracted_id
-                                    })
-
-                                    if existing_doc:
-                                        # Compare timestamps
-                                        existing_timestamp = existing_doc.get('processed_at')
-                                        if existing_timestamp and doc['processed_at'] <= existing_timestamp:
-                                            logger.info(
-                                                f"⏳ Skipping update: {key}\n"
-                                                f"   ID: {extracted_id}\n"
-                                                f"   Existing timestamp: {existing_timestamp}\n"
-                                                f"   New timestamp: {doc['processed_at']}"
-                                            )
-                                            continue
-
-                                    # Insert or update document
-                                    result = collection.update_one(
-                                        {'file_key': key, 'extracted_id': extracted_id},
-                                        {'$set': doc},
-                                        upsert=True
-                                    )
-
-                                    # Log insertion/update
-                                    if result.upserted_id:
-                                        logger.info(
-                                            f"✅ New Document Inserted: {key}\n"
-                                            f"   ID: {extracted_id}\n"
-                                            f"   Additional Fields: {additional_fields}"
-                                        )
-                                    elif result.modified_count > 0:
-                                        logger.info(
-                                            f"🔄 Document Updated: {key}\n"
-                                            f"   ID: {extracted_id}\n"
-                                            f"   Additional Fields: {additional_fields}"
-                                        )
-
-                                    metrics['inserted_lines'] += 1
-                                    file_metrics['inserted_lines'] += 1
-
-                                except Exception as insert_error:
-                                    logger.error(f"MongoDB insertion error: {insert_error}")
-
-                        # Log file processing results
-                        logger.info(
-                            f"File processed: {key}\n"
-                            f"  Processed lines: {file_metrics['processed_lines']}\n"
-                            f"  Inserted lines: {file_metrics['inserted_lines']}"
-                        )
-
-                        metrics['processed_files'] += 1
-
-                    except Exception as e:
-                        logger.error(f"File processing error {key}: {e}")
-                        metrics['error_files'].append(key)
+                    entry = known_objects.get(obj['Key'])
+                    if not object_changed(obj, entry, CONFIG['storage']):
+                        metrics['unchanged_files'] += 1
+                        continue
+                    yield obj, resume_checkpoint(obj, entry, CONFIG['storage'])
+
+            pipeline = IngestPipeline(s3_client, loads, metrics, CONFIG['processing'], progress, limiter)
+            pipeline.run(changed_objects())
 
     except Exception as e:
         logger.error(f"Processing error: {e}")
     finally:
         # Final processing summary
         logger.info(
-            "Processing Summary:\n"
+            f"Processing Summary{f' (shard {format_shard(shard)})' if shard else ''}:\n"
             f"Total files: {metrics['total_files']}\n"
             f"Processed files: {metrics['processed_files']}\n"
+            f"Unchanged files: {metrics['unchanged_files']}\n"
+            f"Resumed files: {metrics['resumed_files']}\n"
             f"Total lines: {metrics['total_lines']}\n"
-            f"Inserted lines: {metrics['inserted_lines']}"
+            f"Changed lines: {metrics['changed_lines']}\n"
+            f"  Upserted lines: {metrics['upserted_lines']}\n"
+            f"  Modified lines: {metrics['modified_lines']}\n"
+            f"Unchanged lines: {metrics['unchanged_lines']}\n"
+            f"Stale lines: {metrics['stale_lines']}\n"
+            f"Malformed lines: {metrics['malformed_lines']}\n"
+            f"Bad deeplink lines: {metrics['bad_deeplink_lines']}\n"
+            f"Throughput: {progress.summary()}"
         )
 
         if metrics['error_files']:
@@ -265,8 +1352,142 @@ def process_do_spaces_files():
             for error_file in metrics['error_files']:
                 logger.warning(f"  {error_file}")
 
+    metrics['progress'] = dict(progress.counters)
+    return metrics
+
+def migrate_to_compact(raw_content=None, batch_size=None):
+    """Rewrite stored full-schema documents into the compact schema in bulk.
+
+    Only documents that still carry 'content' are touched, so an interrupted
+    migration can simply be run again. Their content_hash is tagged like a
+    compact ingest's, and once every document is converted the per_file
+    manifest entries are recorded as compact, so a later full-schema run
+    rewrites them again. Returns the bulk writer totals.
+    """
+    batch_size = batch_size or CONFIG['processing']['batch_size']
+    _, content_unset = build_content_fields(None, 'compact', raw_content)
+
+    with get_mongo_collection(CONFIG['mongodb']) as collection:
+        if collection is None:
+            logger.error("Could not get MongoDB collection. Aborting migration.")
+            return None
+
+        projection = {'content_hash': 1, 'content': 1} if raw_content else {'content_hash': 1}
+        documents = collection.find({'content': {'$exists': True}}, projection, batch_size=batch_size)
+        with BulkUpsertWriter(collection, batch_size, label=f"{collection.name} migration") as writer:
+            for document in documents:
+                content_set = {'content_zlib': encode_raw_content(document['content'])} if raw_content else {}
+                content_set['content_hash'] = stored_content_hash(document.get('content_hash'), 'compact', raw_content)
+                writer.add(UpdateOne({'_id': document['_id']}, {'$set': content_set, '$unset': content_unset}))
+
+        if not writer.totals['errors']:
+            compact = storage_signature({'layout': 'per_file', 'schema': 'compact', 'raw_content': raw_content})
+            collection.database[CONFIG['mongodb']['manifest_collection']].update_many(
+                {'storage.layout': 'per_file'},
+                {'$set': {'storage': compact}, '$unset': {'checkpoint': ''}}
+            )
+
+    logger.info(
+        f"migration collection={CONFIG['mongodb']['collection']} "
+        f"modified={writer.totals['modified']} errors={writer.totals['errors']}"
+    )
+    return writer.totals
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync DO Spaces deeplink files into MongoDB.")
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help="Ignore the sync manifest and re-ingest every object under the prefix."
+    )
+    parser.add_argument(
+        '--log-mode',
+        choices=['metrics', 'verbose'],
+        default=CONFIG['logging']['mode'],
+        help="'metrics' for one-line records and periodic throughput, 'verbose' for per-batch logs."
+    )
+    parser.add_argument(
+        '--doc-sample-rate',
+        type=float,
+        default=CONFIG['logging']['doc_sample_rate'],
+        help="Fraction of documents to log individually."
+    )
+    parser.add_argument(
+        '--issue-sample-rate',
+        type=float,
+        default=CONFIG['logging']['issue_sample_rate'],
+        help="Fraction of malformed lines to log individually in metrics mode; all are counted."
+    )
+    parser.add_argument(
+        '--parse-processes',
+        action='store_true',
+        help="Decode JSONL in a pool of worker processes instead of threads."
+    )
+    parser.add_argument(
+        '--id-filter',
+        default=CONFIG['processing']['id_filter'],
+        help="Bloom filter file of wanted IDs (see id_filter.py); other lines are skipped."
+    )
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        help="Ingest only shard index/count of the listed objects, e.g. 0/4."
+    )
+    parser.add_argument(
+        '--shard-strategy',
+        choices=['hash', 'size'],
+        default=CONFIG['processing']['shard_strategy'],
+        help="'hash' assigns objects by key, 'size' balances bytes across shards."
+    )
+    parser.add_argument(
+        '--stale-items',
+        choices=['delete', 'flag', 'none'],
+        default=CONFIG['processing']['stale_items'] or 'none',
+        help="What to do with stored rows whose IDs are gone from a fully ingested object."
+    )
+    parser.add_argument(
+        '--layout',
+        choices=['per_file', 'per_title'],
+        default=CONFIG['storage']['layout'],
+        help="'per_title' merges every file's deeplinks into one document per extracted_id."
+    )
+    parser.add_argument(
+        '--schema',
+        choices=['full', 'compact'],
+        default=CONFIG['storage']['schema'],
+        help="'compact' stores deeplinks and additional_fields only, without the full line."
+    )
+    parser.add_argument(
+        '--raw-content',
+        choices=['none', 'zlib'],
+        default=CONFIG['storage']['raw_content'] or 'none',
+        help="With the compact schema, keep the raw line zlib-compressed or drop it."
+    )
+    parser.add_argument(
+        '--migrate-compact',
+        action='store_true',
+        help="Rewrite existing documents into the compact schema instead of ingesting."
+    )
+    return parser.parse_args()
+
 def main():
-    process_do_spaces_files()
+    args = parse_args()
+    CONFIG['logging']['mode'] = args.log_mode
+    CONFIG['logging']['doc_sample_rate'] = args.doc_sample_rate
+    CONFIG['logging']['issue_sample_rate'] = args.issue_sample_rate
+    if args.parse_processes:
+        CONFIG['processing']['parse_mode'] = 'processes'
+    CONFIG['processing']['id_filter'] = args.id_filter
+    CONFIG['processing']['shard'] = args.shard
+    CONFIG['processing']['shard_strategy'] = args.shard_strategy
+    CONFIG['processing']['stale_items'] = None if args.stale_items == 'none' else args.stale_items
+    CONFIG['storage']['layout'] = args.layout
+    CONFIG['storage']['schema'] = args.schema
+    CONFIG['storage']['raw_content'] = None if args.raw_content == 'none' else args.raw_content
+    if args.migrate_compact:
+        migrate_to_compact(CONFIG['storage']['raw_content'])
+        return
+    process_do_spaces_files(full_refresh=args.full_refresh)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CATALOG_NAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixed_document_names.json')
+NAME_PATTERN = re.compile(r'^Content_latest_([a-z]{2})_(.+)_jsonl$')
+
+TITLE_WORDS = [
+    'night', 'river', 'empire', 'shadow', 'love', 'city', 'last', 'secret', 'house', 'war',
+    'summer', 'island', 'ghost', 'dream', 'road', 'king', 'daughter', 'storm', 'silent', 'fire',
+    'ocean', 'heart', 'lost', 'golden', 'winter', 'street', 'family', 'wild', 'black', 'garden'
+]
+MALFORMED_KINDS = ['truncated', 'not_json', 'no_external_ids', 'bad_deeplinks', 'blank']
+
+def load_catalog_names(path=CATALOG_NAMES_FILE):
+    """Return the (country, platform) pairs of the Content_latest_{country}_{platform}_jsonl names in path."""
+    with open(path, encoding='utf-8') as f:
+        names = json.load(f)
+
+    pairs = []
+    for name in names:
+        match = NAME_PATTERN.match(name)
+        if match:
+            pairs.append((match.group(1), match.group(2)))
+    return pairs
+
+def object_name(country, platform):
+    return f"Content_latest_{country}_{platform}_jsonl"
+
+def plan_catalog(pairs, rows, skew=1.0, files=None, seed=0):
+    """Split rows over catalog files as a list of (country, platform, row_count).
+
+    Platforms get a Zipf-like share (rank ** -skew, ranks shuffled by seed), split
+    evenly between that platform's countries, so skew=0 is uniform and larger
+    values concentrate rows on a few big platforms as in production.
+    """
+    rng = random.Random(seed)
+    pairs = sorted(pairs)
+    if files is not None and files < len(pairs):
+        pairs = sorted(rng.sample(pairs, files))
+
+    platforms = sorted({platform for _, platform in pairs})
+    rng.shuffle(platforms)
+    platform_weight = {platform: (rank + 1) ** -skew for rank, platform in enumerate(platforms)}
+    files_per_platform = {}
+    for _, platform in pairs:
+        files_per_platform[platform] = files_per_platform.get(platform, 0) + 1
+
+    weights = [platform_weight[platform] / files_per_platform[platform] for _, platform in pairs]
+    total_weight = sum(weights)
+    shares = [rows * weight / total_weight for weight in weights]
+    counts = [math.floor(share) for share in shares]
+
+    # Hand the rounding remainder to the files with the largest fractional parts
+    remainder = rows - sum(counts)
+    by_fraction = sorted(range(len(pairs)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_fraction[:remainder]:
+        counts[i] += 1
+
+    return [(country, platform, count) for (country, platform), count in zip(pairs, counts)]
+
+class CatalogGenerator:
+    """Produce reproducible catalog lines shaped like the Content_latest JSONL exports.
+
+    Titles come from a shared universe of title_count numeric IDs, so the same
+    title shows up across countries and platforms like real catalogs. Within one
+    file every ID is distinct apart from the injected duplicates, which repeat a
+    recent line either verbatim or with refreshed deeplinks.
+    """
+
+    def __init__(self, seed=0, title_count=1_000_000, duplicate_rate=0.0, malformed_rate=0.0):
+        self.seed = seed
+        self.title_count = title_count
+        self.duplicate_rate = duplicate_rate
+        self.malformed_rate = malformed_rate
+
+    def _file_rng(self, country, platform):
+        digest = hashlib.blake2b(f"{self.seed}:{country}:{platform}".encode('utf-8'), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, 'big'))
+
+    def _title_ids(self, rng, rows):
+        """Yield distinct title IDs in O(1) memory with an affine permutation of the title universe."""
+        universe = max(self.title_count, rows)
+        step = rng.randrange(1, universe)
+        while math.gcd(step, universe) != 1:
+            step += 1
+        offset = rng.randrange(universe)
+        for i in range(rows):
+            yield (offset + i * step) % universe + 1
+
+    def record(self, title_id, country, platform, rng):
+        """Build one catalog record for title_id as listed by platform in country."""
+        # Title metadata depends only on the ID so it matches across files
+        title_rng = random.Random(title_id)
+        words = title_rng.sample(TITLE_WORDS, title_rng.randint(1, 4))
+        title = ' '.join(words).title()
+        kind = 'serie' if title_rng.random() < 0.3 else 'movie'
+        uid = hashlib.blake2b(f"{platform}:{title_id}".encode('utf-8'), digest_size=16).hexdigest()
+
+        external_ids = [{'Provider': 'tmdb', 'ID': title_id if rng.random() < 0.8 else str(title_id)}]
+        if rng.random() < 0.3:
+            external_ids.insert(0, {'Provider': 'imdb', 'ID': f"tt{title_id:07d}"})
+
+        base = f"https://www.{platform}.com/{country}/{kind}/{uid}"
+        deeplinks = {'Web': base, 'Android': None, 'iOS': None}
+        if rng.random() < 0.6:
+            deeplinks['Android'] = f"{platform}://{kind}/{uid}"
+            deeplinks['iOS'] = f"{platform}://{kind}/{uid}"
+
+        return {
+            'UID': uid,
+            'PlatformName': platform,
+            'PlatformCountry': country.upper(),
+            'Title': title,
+            'CleanTitle': re.sub(r'[^a-z0-9 ]', '', title.lower()),
+            'OriginalTitle': title if title_rng.random() < 0.5 else None,
+            'Type': kind,
+            'Year': title_rng.randint(1950, 2025),
+            'Duration': title_rng.randint(20, 60) if kind == 'serie' else title_rng.randint(70, 180),
+            'ExternalIds': external_ids,
+            'Deeplinks': deeplinks
+        }
+
+    def _malformed(self, record, rng):
+        kind = rng.choice(MALFORMED_KINDS)
+        if kind == 'truncated':
+            line = json.dumps(record, ensure_ascii=False)
+            return line[:rng.randint(1, len(line) - 1)]
+        if kind == 'not_json':
+            return f"ERROR exporting {record['UID']}"
+        if kind == 'no_external_ids':
+            record = dict(record, ExternalIds=[])
+        elif kind == 'bad_deeplinks':
+            record = dict(record, Deeplinks=list(record['Deeplinks'].values()))
+        else:
+            return ''
+        return json.dumps(record, ensure_ascii=False)
+
+    def iter_lines(self, country, platform, rows):
+        """Yield rows lines (without newlines) for one catalog file, duplicates and malformed lines included."""
+        rng = self._file_rng(country, platform)
+        recent = []
+        title_ids = self._title_ids(rng, rows)
+
+        for _ in range(rows):
+            roll = rng.random()
+            if roll < self.duplicate_rate and recent:
+                title_id, line = rng.choice(recent)
+                if rng.random() < 0.5:
+                    yield line
+                else:
+                    record = self.record(title_id, country, platform, rng)
+                    record['Deeplinks']['Web'] += '?ref=refresh'
+                    yield json.dumps(record, ensure_ascii=False)
+                continue
+
+            title_id = next(title_ids)
+            record = self.record(title_id, country, platform, rng)
+            if self.duplicate_rate <= roll < self.duplicate_rate + self.malformed_rate:
+                yield self._malformed(record, rng)
+                continue
+
+            line = json.dumps(record, ensure_ascii=False)
+            # Keep a bounded pool of recent lines to duplicate from
+            if len(recent) < 1000:
+                recent.append((title_id, line))
+            else:
+                recent[rng.randrange(1000)] = (title_id, line)
+            yield line
+
+    def write_file(self, path, country, platform, rows):
+        """Write one catalog file and return its size in bytes."""
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            for line in self.iter_lines(country, platform, rows):
+                f.write(line)
+                f.write('\n')
+        return os.path.getsize(path)
+
+def write_catalog(generator, plan, output_dir):
+    """Write every planned file into output_dir and return (files, total_bytes, total_rows)."""
+    os.makedirs(output_dir, exist_ok=True)
+    total_bytes = 0
+    for country, platform, rows in plan:
+        path = os.path.join(output_dir, object_name(country, platform))
+        total_bytes += generator.write_file(path, country, platform, rows)
+        logger.info(f"Wrote {path}: {rows} rows")
+    return len(plan), total_bytes, sum(rows for _, _, rows in plan)
+
+def upload_catalog(generator, plan, s3_client, bucket, prefix):
+    """Generate every planned file through a temporary file and upload it under prefix.
+
+    Returns (files, total_bytes, total_rows).
+    """
+    total_bytes = 0
+    for country, platform, rows in plan:
+        key = f"{prefix}{object_name(country, platform)}"
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            total_bytes += generator.write_file(path, country, platform, rows)
+            s3_client.upload_file(path, bucket, key)
+        finally:
+            os.unlink(path)
+        logger.info(f"Uploaded {key}: {rows} rows")
+    return len(plan), total_bytes, sum(rows for _, _, rows in plan)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic Content_latest JSONL catalog files.")
+    parser.add_argument('--rows', type=int, required=True, help="Total rows across all files.")
+    parser.add_argument('--files', type=int, help="Number of catalog names to use (default: all of them).")
+    parser.add_argument('--names', default=CATALOG_NAMES_FILE, help="JSON list of Content_latest_* names.")
+    parser.add_argument('--titles', type=int, default=1_000_000, help="Size of the shared title ID universe.")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of rows per platform (0 = uniform).")
+    parser.add_argument('--seed', type=int, default=0)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output-dir', help="Write the files into this directory.")
+    target.add_argument('--bucket', help="Upload the files to this bucket instead.")
+    parser.add_argument('--prefix', default='Content/latest/')
+    parser.add_argument('--endpoint', help="S3-compatible endpoint URL for --bucket.")
+    return parser.parse_args()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+
+    plan = plan_catalog(load_catalog_names(args.names), args.rows, args.skew, args.files, args.seed)
+    generator = CatalogGenerator(args.seed, args.titles, args.duplicate_rate, args.malformed_rate)
+
+    if args.bucket:
+        import boto3
+
+        s3_client = boto3.client('s3', endpoint_url=args.endpoint)
+        files, total_bytes, total_rows = upload_catalog(generator, plan, s3_client, args.bucket, args.prefix)
+    else:
+        files, total_bytes, total_rows = write_catalog(generator, plan, args.output_dir)
+
+    logger.info(f"Generated {files} files, {total_rows} rows, {total_bytes / 1024 / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main()
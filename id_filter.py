@@ -0,0 +1,124 @@
+import argparse
+import hashlib
+import logging
+import math
+import re
+import struct
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'BLM1'
+HEADER = struct.Struct('>4sQI')
+
+# First digit-only "ID" inside the ExternalIds array, matching what
+# extract_numeric_id picks from the decoded line
+EXTERNAL_ID_PATTERN = re.compile(rb'"ExternalIds"\s*:\s*\[.*?"ID"\s*:\s*"?(\d+)"?\s*[,}]', re.DOTALL)
+
+class BloomFilter:
+    """Fixed-size membership filter over integer IDs: no false negatives, tunable false positives."""
+
+    def __init__(self, size_bits, hash_count, bits=None):
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((size_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001):
+        """Size a filter for capacity IDs at the given false positive rate."""
+        capacity = max(capacity, 1)
+        size_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(size_bits / capacity * math.log(2)))
+        return cls(size_bits, hash_count)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(str(value).encode('ascii'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return ((first + i * second) % self.size_bits for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(FILE_MAGIC, self.size_bits, self.hash_count))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, size_bits, hash_count = HEADER.unpack(f.read(HEADER.size))
+            if magic != FILE_MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            bits = bytearray(f.read())
+        if len(bits) != (size_bits + 7) // 8:
+            raise ValueError(f"{path} is truncated")
+        return cls(size_bits, hash_count, bits)
+
+def scan_external_id(line):
+    """Return the numeric external ID of a raw JSONL line without decoding it, or None if not found."""
+    match = EXTERNAL_ID_PATTERN.search(line)
+    return int(match.group(1)) if match else None
+
+def may_be_wanted(id_filter, line):
+    """Tell whether a raw line can belong to the wanted catalog.
+
+    Lines without a recognisable ID are kept, so the full decode makes the
+    final call on anything the scan cannot read.
+    """
+    extracted_id = scan_external_id(line)
+    return extracted_id is None or extracted_id in id_filter
+
+def build_filter(ids, error_rate=0.001):
+    """Build a filter from an iterable of IDs (ints or digit strings); non-numeric ones are ignored."""
+    ids = {int(value) for value in ids if str(value).strip().isdigit()}
+    id_filter = BloomFilter.for_capacity(len(ids), error_rate)
+    for value in ids:
+        id_filter.add(value)
+    logger.info(
+        f"Bloom filter ids={len(ids)} bits={id_filter.size_bits} hashes={id_filter.hash_count} "
+        f"kb={len(id_filter.bits) / 1024:.0f}"
+    )
+    return id_filter
+
+def iter_id_file(path):
+    """Yield the IDs of a file with one ID per line."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield line.strip()
+
+def iter_firestore_ids(collection, credentials_path):
+    """Yield the document IDs of a Firestore catalog collection such as Data_EN."""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+    for document in firestore.client().collection(collection).select([]).stream():
+        yield document.id
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the Bloom filter of wanted catalog IDs used by the ingester.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--ids', help="Text file with one ID per line.")
+    source.add_argument('--firestore-collection', help="Firestore collection whose document IDs are the wanted IDs, e.g. Data_EN.")
+    parser.add_argument('--credentials', help="Firebase service account JSON, for --firestore-collection.")
+    parser.add_argument('--error-rate', type=float, default=0.001, help="Target false positive rate.")
+    parser.add_argument('--output', required=True, help="Path of the filter file to write.")
+    return parser.parse_args()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+
+    if args.ids:
+        ids = iter_id_file(args.ids)
+    else:
+        ids = iter_firestore_ids(args.firestore_collection, args.credentials)
+    build_filter(ids, args.error_rate).save(args.output)
+
+if __name__ == "__main__":
+    main()
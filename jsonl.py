@@ -1,6 +1,7 @@
 import boto3
 import json
 import math
+from spaces_reader import iter_object_lines
 
 # Credenciales de AWS
 AWS_ACCESS_KEY_ID = ''
@@ -9,6 +10,8 @@ AWS_REGION_NAME = ''
 AWS_BUCKET_NAME = ''
 TARGET_PREFIX = ''  # Ruta específica en el bucket
 
+JSONL_SUFFIXES = ('.jsonl', '.jsonl.gz', '.jsonl.zst')
+
 
 def list_jsonl_files(s3_client, bucket_name, prefix):
     """
@@ -20,8 +23,8 @@ def list_jsonl_files(s3_client, bucket_name, prefix):
             print(f"No se encontraron archivos en la ruta {prefix}")
             return []
         
-        # Filtrar solo los archivos JSONL
-        return [file['Key'] for file in response['Contents'] if file['Key'].endswith('.jsonl')]
+        # Filtrar solo los archivos JSONL, comprimidos o no
+        return [file['Key'] for file in response['Contents'] if file['Key'].endswith(JSONL_SUFFIXES)]
     except Exception as e:
         print(f"Error al listar archivos: {e}")
         return []
@@ -32,15 +35,16 @@ def get_jsonl_from_s3(s3_client, bucket_name, key):
     Obtiene el contenido de un archivo JSONL y lo devuelve como una lista de objetos JSON.
     """
     try:
-        file_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
-        file_content = file_obj['Body'].read().decode('utf-8')
         json_lines = []
-        
-        for line in file_content.strip().split('\n'):
+
+        # Leer el archivo línea a línea sin cargarlo entero en memoria
+        for line_num, line in iter_object_lines(s3_client, bucket_name, key):
+            if not line.strip():
+                continue
             try:
                 json_lines.append(json.loads(line))  # Convertir cada línea a JSON
             except json.JSONDecodeError as e:
-                print(f"Error al decodificar una línea en {key}: {e}")
+                print(f"Error al decodificar la línea {line_num} en {key}: {e}")
         
         return json_lines
     except Exception as e:
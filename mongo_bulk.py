@@ -0,0 +1,120 @@
+import copy
+import logging
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Raised by an upsert whose filter did not match an existing (file_key, extracted_id)
+# document: the conditional part of the filter rejected the write, so it is a skip.
+# Also raised when two upserts insert the same new _id at once and one loses the race.
+DUPLICATE_KEY_ERROR = 11000
+
+class BulkUpsertWriter:
+    """Collect UpdateOne operations and send them to MongoDB in unordered bulk_write batches.
+
+    With retry_duplicates, operations rejected with a duplicate key error are
+    sent once more as plain updates. An upsert that lost an insert race to
+    another writer then finds the winner's document and applies, while an
+    unchanged row matches nothing and is not written again; the operations
+    that did not match are counted as skipped (unchanged).
+    """
+
+    def __init__(self, collection, batch_size=1000, label=None, log_level=logging.INFO, retry_duplicates=False):
+        self.collection = collection
+        self.log_level = log_level
+        self.batch_size = batch_size
+        self.label = label or collection.name
+        self.retry_duplicates = retry_duplicates
+        self.operations = []
+        self.totals = {
+            'batches': 0,
+            'operations': 0,
+            'upserted': 0,
+            'modified': 0,
+            'matched': 0,
+            'skipped': 0,
+            'retried': 0,
+            'errors': 0
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, operation):
+        """Queue an operation, flushing when the batch is full. Returns the batch counts if a flush happened."""
+        self.operations.append(operation)
+        if len(self.operations) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Send the queued operations in a single bulk_write and return the batch counts."""
+        if not self.operations:
+            return None
+
+        operations, self.operations = self.operations, []
+        batch = {
+            'operations': len(operations),
+            'upserted': 0,
+            'modified': 0,
+            'matched': 0,
+            'skipped': 0,
+            'retried': 0,
+            'errors': 0
+        }
+        duplicates = self._write(operations, batch)
+        skipped = len(duplicates)
+        if duplicates and self.retry_duplicates:
+            batch['retried'] = len(duplicates)
+            matched, errors = batch['matched'], batch['errors']
+            self._write([without_upsert(operation) for operation in duplicates], batch)
+            skipped -= (batch['matched'] - matched) + (batch['errors'] - errors)
+        batch['skipped'] = skipped
+
+        self.totals['batches'] += 1
+        for field, value in batch.items():
+            self.totals[field] += value
+
+        logger.log(
+            self.log_level,
+            f"Batch written to {self.label}: "
+            f"{batch['operations']} ops, "
+            f"{batch['upserted']} upserted, "
+            f"{batch['modified']} modified, "
+            f"{batch['skipped']} skipped, "
+            f"{batch['retried']} retried, "
+            f"{batch['errors']} errors"
+        )
+        return batch
+
+    def _write(self, operations, batch):
+        """Send one unordered bulk_write, add its counts to batch and return the operations rejected as duplicates."""
+        try:
+            details = self.collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+
+        batch['upserted'] += details.get('nUpserted', 0)
+        batch['modified'] += details.get('nModified', 0)
+        batch['matched'] += details.get('nMatched', 0)
+        duplicates = []
+        for error in details.get('writeErrors', []):
+            if error.get('code') == DUPLICATE_KEY_ERROR:
+                duplicates.append(operations[error['index']])
+            else:
+                batch['errors'] += 1
+                logger.error(f"Bulk write error in {self.label}: {error.get('errmsg')}")
+        return duplicates
+
+def without_upsert(operation):
+    """Return a copy of an UpdateOne that only updates an existing document.
+
+    A retried upsert whose filter still does not match would try to insert
+    again and be rejected with a second duplicate key error.
+    """
+    retry = copy.copy(operation)
+    retry._upsert = False
+    return retry
@@ -0,0 +1,139 @@
+import logging
+import pymongo
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Indexes the deeplink collections (processed_files, ID_Deeplinks) need. The
+# conditional upserts also rely on the unique one: without it a rejected upsert
+# inserts a duplicate instead of failing, so unchanged rows are no longer detected.
+DEEPLINK_INDEXES = [
+    IndexModel(
+        [('file_key', pymongo.ASCENDING), ('extracted_id', pymongo.ASCENDING)],
+        unique=True,
+        name='file_key_extracted_id_unique'
+    ),
+    IndexModel([('processed_at', pymongo.DESCENDING)], name='processed_at_desc')
+]
+
+# Shapes of the hot queries as name: (filter, sort). Values are placeholders;
+# only the fields matter to the planner.
+DEEPLINK_QUERIES = {
+    'upsert lookup': ({'file_key': '', 'extracted_id': 0, 'content_hash': {'$ne': ''}}, None),
+    'last processed file': ({}, [('processed_at', pymongo.DESCENDING)])
+}
+
+# Indexes of the per_title collection (deeplink_titles), whose _id is the title's ID.
+# Stale item reconciliation lists the titles of one source in _id order.
+TITLE_INDEXES = [
+    IndexModel([('object_sources', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)], name='object_sources_id')
+]
+
+TITLE_QUERIES = {
+    'stale source titles': ({'object_sources': ''}, [('_id', pymongo.ASCENDING)])
+}
+
+# Below this many documents a collection scan is cheap enough to only warn about
+PLAN_CHECK_MIN_DOCUMENTS = 100000
+
+class IndexBootstrapError(RuntimeError):
+    """The collection is not indexed well enough to ingest into."""
+
+class UnindexedQueryError(IndexBootstrapError):
+    """A hot query would scan a large collection."""
+
+class MissingUniqueIndexError(IndexBootstrapError):
+    """A unique index the conditional upserts rely on does not exist."""
+
+def ensure_indexes(collection, indexes=DEEPLINK_INDEXES):
+    """Create the given indexes if missing. Returns the names of those that could not be created."""
+    failed = []
+    for index in indexes:
+        name = index.document['name']
+        try:
+            collection.create_indexes([index])
+        except Exception as e:
+            logger.warning(f"Could not ensure index {name} on {collection.name}: {e}")
+            failed.append(name)
+    return failed
+
+def find_missing_unique_indexes(collection, indexes=DEEPLINK_INDEXES):
+    """Return the names of the unique indexes in indexes with no unique index on exactly their keys."""
+    existing = [
+        (list(info['key']), info.get('unique', False))
+        for info in collection.index_information().values()
+    ]
+    return [
+        index.document['name']
+        for index in indexes
+        if index.document.get('unique') and (list(index.document['key'].items()), True) not in existing
+    ]
+
+def _plan_stages(plan):
+    """Yield every stage name of an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for field in ('inputStage', 'queryPlan', 'winningPlan'):
+        yield from _plan_stages(plan.get(field))
+    for field in ('inputStages', 'shards'):
+        for child in plan.get(field) or []:
+            yield from _plan_stages(child)
+
+def explain_stages(collection, query, sort=None):
+    """Return the set of stages in the winning plan of find(query).sort(sort).limit(1)."""
+    cursor = collection.find(query).limit(1)
+    if sort:
+        cursor = cursor.sort(sort)
+    planner = cursor.explain().get('queryPlanner', {})
+    return set(_plan_stages(planner.get('winningPlan', {})))
+
+def supports_explain(collection):
+    """Tell whether the collection's cursors can explain their plan; in-memory stand-ins such as mongomock cannot."""
+    return hasattr(collection.find({}).limit(1), 'explain')
+
+def find_collection_scans(collection, queries=DEEPLINK_QUERIES):
+    """Return the names of the queries whose winning plan is a collection scan."""
+    return [
+        name for name, (query, sort) in queries.items()
+        if 'COLLSCAN' in explain_stages(collection, query, sort)
+    ]
+
+def bootstrap_indexes(collection, indexes=DEEPLINK_INDEXES, queries=DEEPLINK_QUERIES,
+                      min_documents=PLAN_CHECK_MIN_DOCUMENTS):
+    """Ensure the indexes exist and check the hot queries use them.
+
+    Raises MissingUniqueIndexError if a unique index could not be created,
+    e.g. because of duplicates or a non-unique index on the same keys: a
+    conditional upsert of an unchanged row would then insert a duplicate
+    instead of failing, whatever the collection size. Raises
+    UnindexedQueryError if a query would still scan a collection of at least
+    min_documents documents, since every per-row lookup would then read the
+    whole collection. Smaller collections only get a warning, and the plan
+    check is skipped where explain() is not available.
+    """
+    ensure_indexes(collection, indexes)
+    missing = find_missing_unique_indexes(collection, indexes)
+    if missing:
+        raise MissingUniqueIndexError(
+            f"Unique index missing on {collection.name}: {', '.join(missing)}; "
+            f"remove duplicates or conflicting indexes on the same keys first"
+        )
+
+    if not supports_explain(collection):
+        logger.warning(f"Query plans of {collection.name} cannot be explained; skipping the plan check")
+        return
+
+    scans = find_collection_scans(collection, queries)
+    if not scans:
+        return
+
+    documents = collection.estimated_document_count()
+    message = (
+        f"Collection scan planned on {collection.name} ({documents} documents) "
+        f"for: {', '.join(scans)}"
+    )
+    if documents >= min_documents:
+        raise UnindexedQueryError(message)
+    logger.warning(message)
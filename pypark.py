@@ -1,13 +1,21 @@
-import json
+import argparse
 import logging
 import pymongo
-import boto3
-from botocore.client import Config
 from datetime import datetime
 from contextlib import contextmanager
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf
-from pyspark.sql.types import StringType
+from pyspark.sql.functions import col
+import mongo_bulk
+import spark_ingest
+from mongo_indexes import IndexBootstrapError, bootstrap_indexes
+from spark_ingest import (
+    KeySetParam,
+    extract_fields,
+    extract_fields_pandas,
+    get_last_processed_file,
+    read_source_lines,
+    write_partition
+)
+from spark_session import SPARK_PROFILES, get_spark_session
 
 # Logging configuration
 logging.basicConfig(
@@ -36,14 +44,34 @@ CONFIG = {
         'auth_source': 'admin',
         'database': 'bubbo',
         'collection': 'processed_files'  # Update collection name
+    },
+    'spark': {
+        # Tuning profile from spark_session.SPARK_PROFILES
+        'profile': 'single-node',
+        # Directory or URI of the Content_latest files; None reads s3a://{bucket}/{prefix}
+        'source': None,
+        # s3a connector, matching the Hadoop version Spark was built with
+        'packages': 'org.apache.hadoop:hadoop-aws:3.3.4',
+        # 'native' extracts fields with Spark expressions; 'pandas' with an Arrow
+        # pandas UDF, for extraction rules that have to stay in Python
+        'extraction': 'native',
+        # UpdateOne operations per bulk_write sent from each executor partition
+        'write_batch_size': 1000,
+        # s3a limits per executor, so reading the whole prefix at once backs off instead of
+        # piling onto a throttled Spaces endpoint
+        's3a': {
+            # HTTP connections and transfer threads
+            'connection_maximum': 32,
+            'threads_maximum': 16,
+            # Attempts per request on transient failures
+            'attempts_maximum': 10,
+            # Retries of SlowDown/503 responses and the initial, exponentially growing, delay between them
+            'retry_throttle_limit': 20,
+            'retry_throttle_interval': '1000ms'
+        }
     }
 }
 
-# Spark session initialization
-spark = SparkSession.builder \
-    .appName("DO Spaces File Processing") \
-    .getOrCreate()
-
 # Existing context manager for MongoDB connection
 @contextmanager
 def get_mongo_collection(config):
@@ -66,187 +94,85 @@ def get_mongo_collection(config):
         if mongo_client:
             mongo_client.close()
 
-# UDFs for PySpark to extract values
-@udf(StringType())
-def extract_numeric_id(line):
-    """Extract first numeric ID from ExternalIds."""
-    try:
-        data = json.loads(line)
-        external_ids = data.get("ExternalIds", [])
-
-        if not external_ids or not isinstance(external_ids, list):
-            return None
-
-        for item in external_ids:
-            if isinstance(item, dict) and "ID" in item:
-                id_value = item["ID"]
-                if isinstance(id_value, int):
-                    return str(id_value)
-                elif isinstance(id_value, str) and id_value.isdigit():
-                    return str(id_value)
-        return None
-    except Exception as e:
-        logger.error(f"ID extraction error: {e}")
-        return None
-
-@udf(StringType())
-def extract_deeplinks(line):
-    """Extract Deeplinks from given line."""
-    try:
-        data = json.loads(line)
-        deeplinks = data.get("Deeplinks", {})
-        return json.dumps(deeplinks) if isinstance(deeplinks, dict) else "{}"
-    except Exception as e:
-        logger.error(f"Deeplink extraction error: {e}")
-        return "{}"
-
-@udf(StringType())
-def extract_additional_fields(line):
-    """Extract additional fields from the line, including Title, CleanTitle, OriginalTitle, Type, Year, Duration."""
-    try:
-        data = json.loads(line)
-
-        # Extract the additional fields
-        additional_fields = {
-            "Title": data.get("Title", ""),
-            "CleanTitle": data.get("CleanTitle", ""),
-            "OriginalTitle": data.get("OriginalTitle", None),
-            "Type": data.get("Type", ""),
-            "Year": data.get("Year", None),
-            "Duration": data.get("Duration", None)
-        }
-
-        return json.dumps(additional_fields)  # Return the extracted fields as a JSON string
-
-    except Exception as e:
-        logger.error(f"Additional fields extraction error: {e}")
-        return "{}"  # Return empty JSON on error
-
-def get_last_processed_file(collection):
-    """Retrieve the last processed file from MongoDB."""
-    last_file = collection.find_one(sort=[("processed_at", pymongo.DESCENDING)])
-    return last_file['file_key'] if last_file else None
-
 def process_do_spaces_files(starting_file=None):
-    """Process DigitalOcean Spaces files and store in MongoDB using PySpark."""
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=CONFIG['do_spaces']['access_key'],
-        aws_secret_access_key=CONFIG['do_spaces']['secret_key'],
-        endpoint_url=CONFIG['do_spaces']['endpoint'],
-        config=Config(signature_version='s3v4'),
-        region_name='nyc3'
-    )
+    """Process DigitalOcean Spaces files and store in MongoDB using PySpark.
 
+    With starting_file, only files from that key onwards in listing order are
+    processed. Returns the processing metrics.
+    """
     # Processing metrics
     metrics = {
         'total_files': 0,
         'processed_files': 0,
         'total_lines': 0,
         'inserted_lines': 0,
+        'unchanged_lines': 0,
+        'write_errors': 0,
         'error_files': []
     }
 
     try:
-        paginator = s3_client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(
-            Bucket=CONFIG['do_spaces']['bucket'],
-            Prefix=CONFIG['do_spaces']['prefix']
-        )
-
         with get_mongo_collection(CONFIG['mongodb']) as collection:
             if collection is None:
                 logger.error("Could not get MongoDB collection. Aborting processing.")
-                return
-
-            for page in pages:
-                for obj in page.get('Contents', []):
-                    key = obj['Key']
-                    metrics['total_files'] += 1
-
-                    # Check if we should skip to the last processed file
-                    if starting_file and key != starting_file:
-                        continue
-
-                    try:
-                        # Read the file content into an RDD
-                        file_obj = s3_client.get_object(
-                            Bucket=CONFIG['do_spaces']['bucket'],
-                            Key=key
-                        )
-
-                        file_content = file_obj['Body'].read().decode('utf-8')
-                        lines = file_content.splitlines()
-
-                        # Convert lines into an RDD and then a DataFrame
-                        lines_rdd = spark.sparkContext.parallelize(lines)
-                        df = lines_rdd.map(lambda line: (line, )).toDF(["line"])
-
-                        # Apply UDFs to extract data
-                        df = df.withColumn("extracted_id", extract_numeric_id(df["line"]))
-                        df = df.withColumn("deeplinks", extract_deeplinks(df["line"]))
-                        df = df.withColumn("additional_fields", extract_additional_fields(df["line"]))
-
-                        # Show the first few rows for logging
-                        df.show(5)
-
-                        # Collect the results and insert them into MongoDB
-                        for row in df.collect():
-                            line = row['line']
-                            extracted_id = row['extracted_id']
-                            deeplinks = row['deeplinks']
-                            additional_fields = row['additional_fields']
-
-                            if extracted_id and deeplinks:
-                                try:
-                                    doc = {
-                                        'file_key': key,
-                                        'extracted_id': extracted_id,
-                                        'content': json.loads(line),
-                                        'deeplinks': json.loads(deeplinks),
-                                        'additional_fields': json.loads(additional_fields),
-                                        'processed_at': datetime.utcnow()
-                                    }
-
-                                    existing_doc = collection.find_one({
-                                        'file_key': key,
-                                        'extracted_id': extracted_id
-                                    })
-
-                                    if existing_doc:
-                                        existing_timestamp = existing_doc.get('processed_at')
-                                        if existing_timestamp and doc['processed_at'] <= existing_timestamp:
-                                            logger.info(f"Skipping update: {key}")
-                                            continue
-
-                                    result = collection.update_one(
-                                        {'file_key': key, 'extracted_id': extracted_id},
-                                        {'$set': doc},
-                                        upsert=True
-                                    )
-
-                                    if result.upserted_id:
-                                        logger.info(f"New Document Inserted: {key}")
-                                    elif result.modified_count > 0:
-                                        logger.info(f"Document Updated: {key}")
-
-                                    metrics['inserted_lines'] += 1
-
-                                except Exception as insert_error:
-                                    logger.error(f"MongoDB insertion error: {insert_error}")
-
-                        metrics['processed_files'] += 1
-
-                        # Update the last processed file in MongoDB
-                        collection.update_one(
-                            {'file_key': key},
-                            {'$set': {'processed_at': datetime.utcnow()}},
-                            upsert=True
-                        )
-
-                    except Exception as e:
-                        logger.error(f"File processing error {key}: {e}")
-                        metrics['error_files'].append(key)
+                return metrics
+
+            try:
+                bootstrap_indexes(collection)
+            except IndexBootstrapError as e:
+                logger.error(f"{e}. Aborting processing.")
+                return metrics
+
+            spark = get_spark_session(
+                CONFIG['spark']['profile'],
+                overrides={'spark.jars.packages': CONFIG['spark']['packages']}
+            )
+            df = read_source_lines(spark, CONFIG)
+            if starting_file:
+                df = df.filter(col('file_key') >= starting_file)
+
+            # Parse the lines and extract the stored fields as native columns
+            if CONFIG['spark']['extraction'] == 'pandas':
+                df = extract_fields_pandas(df)
+            else:
+                df = extract_fields(df)
+
+            # Show the first few rows for logging
+            df.show(5)
+
+            # Write every partition from its executor and gather the counts
+            sc = spark.sparkContext
+            sc.addPyFile(mongo_bulk.__file__)
+            sc.addPyFile(spark_ingest.__file__)
+            counters = {
+                field: sc.accumulator(0)
+                for field in ('lines', 'upserted', 'modified', 'skipped', 'errors')
+            }
+            file_keys = sc.accumulator(set(), KeySetParam())
+            mongo_config = CONFIG['mongodb']
+            batch_size = CONFIG['spark']['write_batch_size']
+            processed_at = datetime.utcnow()
+            df.foreachPartition(
+                lambda rows: write_partition(
+                    rows, get_mongo_collection, mongo_config, batch_size, processed_at, counters, file_keys
+                )
+            )
+
+            metrics['total_lines'] = counters['lines'].value
+            metrics['inserted_lines'] = counters['upserted'].value + counters['modified'].value
+            metrics['unchanged_lines'] = counters['skipped'].value
+            metrics['write_errors'] = counters['errors'].value
+
+            metrics['total_files'] = len(file_keys.value)
+            for key in sorted(file_keys.value):
+                metrics['processed_files'] += 1
+
+                # Update the last processed file in MongoDB
+                collection.update_one(
+                    {'file_key': key},
+                    {'$set': {'processed_at': datetime.utcnow()}},
+                    upsert=True
+                )
 
     except Exception as e:
         logger.error(f"Processing error: {e}")
@@ -257,7 +183,9 @@ def process_do_spaces_files(starting_file=None):
             f"Total files: {metrics['total_files']}\n"
             f"Processed files: {metrics['processed_files']}\n"
             f"Total lines: {metrics['total_lines']}\n"
-            f"Inserted lines: {metrics['inserted_lines']}"
+            f"Inserted lines: {metrics['inserted_lines']}\n"
+            f"Unchanged lines: {metrics['unchanged_lines']}\n"
+            f"Write errors: {metrics['write_errors']}"
         )
 
         if metrics['error_files']:
@@ -265,7 +193,22 @@ def process_do_spaces_files(starting_file=None):
             for error_file in metrics['error_files']:
                 logger.warning(f"  {error_file}")
 
+    return metrics
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync DO Spaces deeplink files into MongoDB with Spark.")
+    parser.add_argument(
+        '--spark-profile',
+        choices=sorted(SPARK_PROFILES),
+        default=CONFIG['spark']['profile'],
+        help="Spark tuning profile: shuffle partitions, AQE, memory, Arrow and Kryo settings."
+    )
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    CONFIG['spark']['profile'] = args.spark_profile
+
     with get_mongo_collection(CONFIG['mongodb']) as collection:
         if collection is None:
             logger.error("Could not get MongoDB collection. Aborting.")
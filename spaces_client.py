@@ -0,0 +1,138 @@
+import logging
+import time
+from contextlib import contextmanager
+from threading import Condition
+
+import boto3
+from botocore.client import Config
+
+logger = logging.getLogger(__name__)
+
+# Connections kept per client; should cover every GET that can be in flight at once
+DEFAULT_POOL_CONNECTIONS = 32
+# Attempts per request, including the first, under botocore's adaptive retry mode
+DEFAULT_MAX_ATTEMPTS = 10
+
+THROTTLE_CODES = {'SlowDown', 'ServiceUnavailable', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', '503'}
+THROTTLE_STATUSES = {429, 503}
+
+def create_spaces_client(config, max_pool_connections=DEFAULT_POOL_CONNECTIONS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                         limiter=None):
+    """Build the S3 client for a do_spaces CONFIG section.
+
+    Retries use botocore's adaptive mode, whose client-side token bucket slows
+    the request rate after SlowDown responses instead of retrying at full speed.
+    Those responses are retried inside botocore and never reach the caller, so
+    a limiter, if given, watches every attempt of the client's requests.
+    """
+    client = boto3.client(
+        's3',
+        aws_access_key_id=config['access_key'],
+        aws_secret_access_key=config['secret_key'],
+        endpoint_url=config['endpoint'],
+        config=Config(
+            signature_version='s3v4',
+            max_pool_connections=max_pool_connections,
+            retries={'mode': 'adaptive', 'max_attempts': max_attempts}
+        ),
+        region_name=config.get('region', 'nyc3')
+    )
+    if limiter is not None:
+        limiter.watch(client)
+    return client
+
+def is_throttle_response(response):
+    """Tell whether a parsed Spaces response (or an error's .response) is a throttling answer."""
+    response = response or {}
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in THROTTLE_CODES or status in THROTTLE_STATUSES
+
+def is_throttle_error(error):
+    """Tell whether an exception raised by a Spaces request means the bucket is throttling."""
+    return is_throttle_response(getattr(error, 'response', None))
+
+class AimdLimiter:
+    """Concurrency limit for Spaces GETs with additive increase, multiplicative decrease.
+
+    The limit grows by one for every limit successful requests while the smoothed
+    latency stays within latency_tolerance times the best smoothed latency seen,
+    and is multiplied by decrease on a throttling error or once latency drifts
+    above that. Requests started before the last decrease do not decrease it
+    again, so one burst of SlowDown responses only halves the limit once.
+    Once watch() hooks it into a client, throttled attempts that botocore
+    retries internally count as well, not only the errors it finally raises.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, decrease=0.5, latency_tolerance=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.decreased_at = 0.0
+        self.condition = Condition()
+
+    def watch(self, client):
+        """Back off on every throttled attempt of the client's requests, including the ones botocore retries."""
+        client.meta.events.register('before-call.s3', self._on_before_call)
+        client.meta.events.register('needs-retry.s3', self._on_needs_retry)
+
+    def _on_before_call(self, context, **kwargs):
+        context['aimd_started'] = time.monotonic()
+
+    def _on_needs_retry(self, response, request_dict, **kwargs):
+        # response is (http_response, parsed), or None when the attempt raised
+        if response is not None and is_throttle_response(response[1]):
+            self._backoff(request_dict['context'].get('aimd_started', 0.0), 'throttled')
+
+    @contextmanager
+    def slot(self, measure=True):
+        """Hold one unit of concurrency for the duration of a request.
+
+        With measure=False the request's latency is not recorded and its success
+        does not widen the limit, for requests whose duration is not comparable
+        with the others (such as a streaming GET that only returns headers).
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_throttle_error(e):
+                self._backoff(started, 'throttled')
+            raise
+        else:
+            if measure:
+                self._record(started, time.monotonic() - started)
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def _record(self, started, elapsed):
+        with self.condition:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            self.baseline = self.latency if self.baseline is None else min(self.baseline, self.latency)
+            slow = self.latency > self.baseline * self.latency_tolerance
+        if slow:
+            self._backoff(started, 'slow')
+            return
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _backoff(self, started, reason):
+        with self.condition:
+            if started < self.decreased_at:
+                return
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.decreased_at = time.monotonic()
+            limit = int(self.limit)
+        logger.info(f"spaces_limit reason={reason} limit={limit}")
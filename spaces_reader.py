@@ -0,0 +1,395 @@
+import io
+import logging
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes requested from the S3 StreamingBody per read
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Bytes fetched per ranged GET when an object is downloaded in parallel ranges
+RANGE_SIZE = 8 * 1024 * 1024
+# A single line larger than this is treated as a corrupt object rather than buffered
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+MAGIC_BYTES = len(ZSTD_MAGIC)
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+
+def _decode_line(raw, encoding):
+    """Decode a raw line, dropping the carriage return of CRLF line endings."""
+    if raw.endswith(b'\r'):
+        raw = raw[:-1]
+    return raw.decode(encoding)
+
+def iter_lines(stream, chunk_size=DEFAULT_CHUNK_SIZE, encoding='utf-8', max_line_bytes=MAX_LINE_BYTES):
+    """Yield (line_number, line) pairs from a binary stream without reading it whole.
+
+    Only the current chunk plus the unfinished tail line are buffered, so memory
+    stays around chunk_size regardless of the object size. Lines are split on
+    newlines only and numbered from 1, blank lines included.
+    """
+    buffer = bytearray()
+    line_number = 0
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                break
+            line_number += 1
+            yield line_number, _decode_line(buffer[start:end], encoding)
+            start = end + 1
+        del buffer[:start]
+
+        if len(buffer) > max_line_bytes:
+            raise ValueError(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+
+    if buffer:
+        line_number += 1
+        yield line_number, _decode_line(buffer, encoding)
+
+def iter_line_blocks(stream, chunk_size=DEFAULT_CHUNK_SIZE, max_line_bytes=MAX_LINE_BYTES, first_line=1):
+    """Yield (first_line_number, block) pairs of raw bytes cut on line boundaries.
+
+    Each block holds only complete lines (the last one may lack its newline at
+    the end of the stream), so blocks can be decoded independently, e.g. in other
+    processes. Line numbers follow the same rules as iter_lines, counting from
+    first_line when the stream starts mid-object.
+    """
+    buffer = bytearray()
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+
+        cut = buffer.rfind(b'\n')
+        if cut == -1:
+            if len(buffer) > max_line_bytes:
+                raise ValueError(f"Line {first_line} exceeds {max_line_bytes} bytes")
+            continue
+
+        block = bytes(buffer[:cut + 1])
+        del buffer[:cut + 1]
+        yield first_line, block
+        first_line += block.count(b'\n')
+
+    if buffer:
+        yield first_line, bytes(buffer)
+
+def compression_from_key(key):
+    """Return 'gzip', 'zstd' or None from the object key suffix."""
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if key.endswith(suffix):
+            return compression
+    return None
+
+def compression_from_magic(head):
+    """Return 'gzip', 'zstd' or None from the first bytes of an object."""
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+class _PrefixedStream:
+    """Hand back bytes already read from a stream before reading the rest of it."""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+    def close(self):
+        self.stream.close()
+
+class GzipStreamReader:
+    """Decompress a gzip stream incrementally, concatenated members included.
+
+    Each read feeds at most chunk_size compressed bytes and returns at most size
+    decompressed bytes, so memory stays bounded however well the data compresses.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.pending = b''
+        self.in_member = False
+        self.exhausted = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+
+        while True:
+            if not self.pending and not self.exhausted:
+                self.pending = self.stream.read(self.chunk_size)
+                self.exhausted = not self.pending
+            if not self.pending:
+                if self.in_member:
+                    raise EOFError("Compressed stream ended before the end-of-stream marker")
+                return b''
+
+            self.in_member = True
+            data = self.decompressor.decompress(self.pending, size)
+            self.pending = self.decompressor.unconsumed_tail
+            if self.decompressor.eof:
+                # Start over for the next member, if any. The bytes past the member
+                # are in unused_data; unconsumed_tail holds them too, so it is dropped.
+                self.pending = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.in_member = False
+            if data:
+                return data
+
+    def close(self):
+        self.stream.close()
+
+def open_decompressed(stream, compression, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Wrap a raw object stream in a streaming decompressor for compression ('gzip' or 'zstd')."""
+    if compression == 'gzip':
+        return GzipStreamReader(stream, chunk_size)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd-compressed object found but zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(
+            stream,
+            read_size=chunk_size,
+            read_across_frames=True,
+            closefd=True
+        )
+    raise ValueError(f"Unknown compression: {compression}")
+
+def _discard(stream, count, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Read and drop count bytes from a stream."""
+    while count > 0:
+        data = stream.read(min(count, chunk_size))
+        if not data:
+            raise EOFError(f"Stream ended {count} bytes before the resume offset")
+        count -= len(data)
+
+def _get_range(s3_client, bucket, key, start, end, limiter=None):
+    """Fetch the inclusive byte range [start, end] of an object, holding a limiter slot if given."""
+    with limiter.slot() if limiter is not None else nullcontext():
+        body = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+def _byte_ranges(size, range_size, start=0):
+    return [(offset, min(offset + range_size, size) - 1) for offset in range(start, size, range_size)]
+
+class RangedObjectReader:
+    """Read-only stream over an object fetched as concurrent byte ranges.
+
+    Up to max_workers ranges are in flight at once and they are handed out in
+    object order, so iter_lines and iter_line_blocks stitch lines across range
+    boundaries exactly as they do for a single GET. Memory is bounded by
+    (max_workers + 1) * range_size. A shared limiter (spaces_client.AimdLimiter)
+    can hold the GETs actually in flight below max_workers.
+    """
+
+    def __init__(self, s3_client, bucket, key, size, range_size=RANGE_SIZE, max_workers=4, start=0, limiter=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.ranges = deque(_byte_ranges(size, range_size, start))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.current = b''
+        self.position = 0
+        self._prefetch()
+
+    def _prefetch(self):
+        while self.ranges and len(self.pending) < self.max_workers:
+            start, end = self.ranges.popleft()
+            self.pending.append(
+                self.executor.submit(_get_range, self.s3_client, self.bucket, self.key, start, end, self.limiter)
+            )
+
+    def read(self, size=-1):
+        while self.position >= len(self.current):
+            if not self.pending:
+                return b''
+            self.current = self.pending.popleft().result()
+            self.position = 0
+            self._prefetch()
+
+        if size is None or size < 0:
+            size = len(self.current) - self.position
+        data = self.current[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
+
+def iter_object_range_blocks(s3_client, bucket, key, size, range_size=RANGE_SIZE, max_workers=4, start=0,
+                             limiter=None):
+    """Yield (byte_offset, block) pairs of complete lines in whatever order ranges arrive.
+
+    For consumers that do not need line order or line numbers. The complete
+    lines inside a range are yielded as soon as it arrives; a line spanning
+    ranges is yielded once every range it touches has arrived. start must be
+    the offset of a line start. At most max_workers ranges are in flight and a
+    range's bytes are dropped once its block is yielded, so a slow consumer
+    holds back the downloads instead of letting the object pile up in memory.
+    """
+    ranges = _byte_ranges(size, range_size, start)
+    object_start = start
+    # index -> (start, length, head, tail, data). Only ranges without a newline keep
+    # their data (head/tail are None), the others keep just their edge fragments.
+    arrived = {}
+    # Seam after range i (-1 is the start of the object) already yielded
+    seams_done = set()
+
+    def resolve_seam(i):
+        if i == -1:
+            offset, pieces = object_start, []
+        else:
+            start, length, head, tail, _ = arrived[i]
+            offset, pieces = start + length - len(tail), [tail]
+        j = i + 1
+        while j < len(ranges):
+            if j not in arrived:
+                return None
+            _, _, head, _, data = arrived[j]
+            if head is not None:
+                pieces.append(head)
+                return offset, b''.join(pieces)
+            pieces.append(data)
+            j += 1
+        return offset, b''.join(pieces)
+
+    queued = deque(enumerate(ranges))
+    in_flight = {}
+
+    def submit(executor):
+        while queued and len(in_flight) < max_workers:
+            i, (start, end) = queued.popleft()
+            in_flight[executor.submit(_get_range, s3_client, bucket, key, start, end, limiter)] = (i, start)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        submit(executor)
+        while in_flight:
+            future = next(iter(wait(in_flight, return_when=FIRST_COMPLETED).done))
+            i, start = in_flight.pop(future)
+            data = future.result()
+            del future
+            submit(executor)
+
+            if i == 0 and object_start == 0 and compression_from_magic(data):
+                raise ValueError(f"{key} is compressed and cannot be read as unordered byte ranges")
+            first = data.find(b'\n')
+            if first == -1:
+                arrived[i] = (start, len(data), None, None, data)
+            else:
+                last = data.rfind(b'\n')
+                arrived[i] = (start, len(data), data[:first + 1], data[last + 1:], None)
+                if last > first:
+                    yield start + first + 1, data[first + 1:last + 1]
+
+            for seam in [-1] + sorted(arrived):
+                if seam in seams_done or (seam != -1 and arrived[seam][2] is None):
+                    continue
+                resolved = resolve_seam(seam)
+                if resolved is None:
+                    continue
+                seams_done.add(seam)
+                if resolved[1]:
+                    yield resolved
+
+def _open_raw(s3_client, bucket, key, size, range_size, range_workers, start, limiter):
+    if start and size is not None and start >= size:
+        # A checkpoint at the very end: a GET from there would fail with 416
+        return io.BytesIO(b'')
+    if range_workers and size is not None and size - start > range_size:
+        return RangedObjectReader(s3_client, bucket, key, size, range_size, range_workers, start, limiter)
+    extra = {'Range': f"bytes={start}-"} if start else {}
+    # The slot is held until the headers arrive; the body streams outside it
+    with limiter.slot(measure=False) if limiter is not None else nullcontext():
+        return s3_client.get_object(Bucket=bucket, Key=key, **extra)['Body']
+
+def open_object(s3_client, bucket, key, size=None, range_size=RANGE_SIZE, range_workers=0, start=0, compression='auto',
+                limiter=None):
+    """Open a Spaces object as a readable stream, optionally from byte offset start.
+
+    With range_workers > 0 and a known size above range_size, the object is
+    fetched as concurrent byte ranges through RangedObjectReader; otherwise a
+    single GET's StreamingBody is returned. limiter, if given, paces every GET.
+
+    compression is 'gzip', 'zstd', None for raw bytes, or 'auto' to detect it from
+    the key suffix and then the magic bytes. Compressed objects are decompressed
+    as a stream and start counts decompressed bytes; since a compressed stream
+    cannot be entered midway, they are read from the beginning and the first
+    start bytes are discarded.
+    """
+    if compression == 'auto':
+        compression = compression_from_key(key)
+        if compression is None and start:
+            compression = compression_from_magic(_get_range(s3_client, bucket, key, 0, MAGIC_BYTES - 1, limiter))
+        elif compression is None:
+            stream = _open_raw(s3_client, bucket, key, size, range_size, range_workers, 0, limiter)
+            head = stream.read(MAGIC_BYTES)
+            stream = _PrefixedStream(head, stream)
+            compression = compression_from_magic(head)
+            return open_decompressed(stream, compression) if compression else stream
+
+    if compression is None:
+        return _open_raw(s3_client, bucket, key, size, range_size, range_workers, start, limiter)
+
+    stream = open_decompressed(_open_raw(s3_client, bucket, key, size, range_size, range_workers, 0, limiter), compression)
+    if start:
+        try:
+            _discard(stream, start)
+        except Exception:
+            stream.close()
+            raise
+    return stream
+
+def iter_object_lines(s3_client, bucket, key, chunk_size=DEFAULT_CHUNK_SIZE, **open_kwargs):
+    """Stream the lines of a Spaces object as (line_number, line) pairs."""
+    stream = open_object(s3_client, bucket, key, **open_kwargs)
+    try:
+        yield from iter_lines(stream, chunk_size)
+    finally:
+        stream.close()
+
+def iter_object_line_blocks(s3_client, bucket, key, chunk_size=DEFAULT_CHUNK_SIZE, first_line=1, **open_kwargs):
+    """Stream a Spaces object as (first_line_number, block) pairs of complete raw lines."""
+    stream = open_object(s3_client, bucket, key, **open_kwargs)
+    try:
+        yield from iter_line_blocks(stream, chunk_size, first_line=first_line)
+    finally:
+        stream.close()
@@ -0,0 +1,248 @@
+import json
+import math
+import pymongo
+from pymongo import UpdateOne
+from pyspark.accumulators import AccumulatorParam
+from pyspark.sql.functions import (
+    coalesce,
+    col,
+    concat,
+    element_at,
+    filter as array_filter,
+    from_json,
+    input_file_name,
+    length,
+    lit,
+    sha2,
+    size,
+    split,
+    trim,
+    when
+)
+from pyspark.sql.types import ArrayType, LongType, MapType, StringType, StructField, StructType
+from mongo_bulk import BulkUpsertWriter
+
+# Title fields stored under 'additional_fields', extracted as columns of the same name
+ADDITIONAL_FIELDS = ('Title', 'CleanTitle', 'OriginalTitle', 'Type', 'Year', 'Duration')
+
+# Additional fields stored as integers
+NUMERIC_FIELDS = ('Year', 'Duration')
+
+DEEPLINKS_TYPE = MapType(StringType(), StringType())
+
+# Catalog fields the job reads. Every field that may hold a number or an
+# object is a string so that any JSON value parses: numbers keep their digits
+# and objects keep their raw JSON text. A typed field would instead null the
+# whole line whenever one file writes e.g. "Year": "2019".
+CATALOG_SCHEMA = StructType([
+    StructField('Title', StringType()),
+    StructField('CleanTitle', StringType()),
+    StructField('OriginalTitle', StringType()),
+    StructField('Type', StringType()),
+    StructField('Year', StringType()),
+    StructField('Duration', StringType()),
+    StructField('ExternalIds', ArrayType(StructType([StructField('ID', StringType())]))),
+    StructField('Deeplinks', StringType())
+])
+
+# Columns added by either extraction mode
+EXTRACTED_SCHEMA = StructType(
+    [StructField('extracted_id', StringType()), StructField('deeplinks', DEEPLINKS_TYPE)]
+    + [StructField(field, LongType() if field in NUMERIC_FIELDS else StringType()) for field in ADDITIONAL_FIELDS]
+)
+
+def extract_fields(df):
+    """Add the EXTRACTED_SCHEMA columns to a DataFrame of JSONL lines.
+
+    Each line is parsed once by from_json and the fields are plain column
+    expressions, so no row goes through Python. extracted_id is the first
+    all-digit ExternalIds ID, deeplinks the Deeplinks object as a map (empty
+    if it is missing or not an object), and missing title strings become "".
+    Year and Duration are cast to integers, null when not numeric. A
+    malformed line yields a null extracted_id.
+    """
+    df = df.withColumn('data', from_json(col('line'), CATALOG_SCHEMA))
+
+    numeric_ids = array_filter(col('data.ExternalIds'), lambda item: item['ID'].rlike('^[0-9]+$'))
+    raw_deeplinks = col('data.Deeplinks')
+    deeplinks = from_json(when(raw_deeplinks.startswith('{'), raw_deeplinks).otherwise(lit('{}')), DEEPLINKS_TYPE)
+    fields = [
+        col(f'data.{field}').cast(LongType()).alias(field) if field in NUMERIC_FIELDS
+        else col(f'data.{field}').alias(field) if field == 'OriginalTitle'
+        else coalesce(col(f'data.{field}'), lit('')).alias(field)
+        for field in ADDITIONAL_FIELDS
+    ]
+
+    return df.select(
+        *[column for column in df.columns if column != 'data'],
+        when(size(numeric_ids) > 0, numeric_ids.getItem(0)['ID']).alias('extracted_id'),
+        deeplinks.alias('deeplinks'),
+        *fields
+    )
+
+def to_long(value):
+    """Return a JSON value as an integer the way a Spark cast of its text does, or None if it is not numeric."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        # Like the cast, a fractional part is truncated
+        whole, _, fraction = value.strip().partition('.')
+        digits = whole[1:] if whole[:1] in ('+', '-') else whole
+        if digits.isdigit() and (not fraction or fraction.isdigit()):
+            return int(whole)
+    return None
+
+def extract_row(line):
+    """Python version of extract_fields for one line, as a tuple in EXTRACTED_SCHEMA order."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return (None, {}) + (None,) * len(ADDITIONAL_FIELDS)
+
+    extracted_id = None
+    external_ids = data.get('ExternalIds')
+    for item in external_ids if isinstance(external_ids, list) else []:
+        id_value = item.get('ID') if isinstance(item, dict) else None
+        if isinstance(id_value, int) or (isinstance(id_value, str) and id_value.isdigit()):
+            extracted_id = str(id_value)
+            break
+
+    deeplinks = data.get('Deeplinks')
+    if isinstance(deeplinks, dict):
+        # Non-string links keep their JSON text, as from_json gives them in a string map
+        deeplinks = {
+            name: link if link is None or isinstance(link, str)
+            else json.dumps(link, separators=(',', ':'), ensure_ascii=False)
+            for name, link in deeplinks.items()
+        }
+    else:
+        deeplinks = {}
+
+    fields = []
+    for field in ADDITIONAL_FIELDS:
+        value = data.get(field)
+        if field in NUMERIC_FIELDS:
+            value = to_long(value)
+        elif field != 'OriginalTitle':
+            value = value or ''
+        fields.append(value)
+    return (extracted_id, deeplinks, *fields)
+
+def extract_fields_pandas(df):
+    """Add the EXTRACTED_SCHEMA columns with an Arrow-backed pandas UDF running extract_row.
+
+    The UDF returns all the columns as one struct per batch, so each line is
+    decoded once in Python and nothing comes back as JSON text. Needs pandas
+    and pyarrow on the executors.
+    """
+    import pandas as pd
+    from pyspark.sql.functions import pandas_udf
+
+    @pandas_udf(EXTRACTED_SCHEMA)
+    def extract(lines: pd.Series) -> pd.DataFrame:
+        frame = pd.DataFrame([extract_row(line) for line in lines], columns=EXTRACTED_SCHEMA.fieldNames())
+        return frame.astype({field: 'Int64' for field in NUMERIC_FIELDS})
+
+    return df.withColumn('extracted', extract(col('line'))).select(*df.columns, 'extracted.*')
+
+class KeySetParam(AccumulatorParam):
+    """Accumulator of the set of file keys seen by the executors."""
+
+    def zero(self, value):
+        return set()
+
+    def addInPlace(self, keys, other):
+        keys |= other
+        return keys
+
+def write_partition(rows, get_collection, mongo_config, batch_size, processed_at, counters, file_keys):
+    """Executor side of the write: upsert one partition's rows with bulk_write batches.
+
+    Each partition opens its own MongoDB client through get_collection, the
+    job's context manager for a mongodb CONFIG section. Upserts only match a
+    stored document whose content_hash differs, so a retried task or an
+    unchanged row collides with the unique (file_key, extracted_id) index and
+    counts as skipped instead of being written again. The hash comes with the
+    row, so a line is only decoded here to store it under 'content'.
+    """
+    keys = set()
+    lines = 0
+    with get_collection(mongo_config) as collection:
+        if collection is None:
+            # Fail the task so Spark retries it
+            raise RuntimeError("Executor could not get MongoDB collection.")
+
+        with BulkUpsertWriter(collection, batch_size) as writer:
+            for row in rows:
+                lines += 1
+                keys.add(row['file_key'])
+                if not (row['extracted_id'] and row['deeplinks']):
+                    continue
+
+                content_hash = row['content_hash']
+                writer.add(UpdateOne(
+                    {'file_key': row['file_key'], 'extracted_id': row['extracted_id'], 'content_hash': {'$ne': content_hash}},
+                    {'$set': {
+                        'file_key': row['file_key'],
+                        'extracted_id': row['extracted_id'],
+                        'content': json.loads(row['line']),
+                        'content_hash': content_hash,
+                        'deeplinks': row['deeplinks'],
+                        'additional_fields': {field: row[field] for field in ADDITIONAL_FIELDS},
+                        'processed_at': processed_at
+                    }},
+                    upsert=True
+                ))
+
+    counters['lines'].add(lines)
+    for field in ('upserted', 'modified', 'skipped', 'errors'):
+        counters[field].add(writer.totals[field])
+    file_keys.add(keys)
+
+def get_last_processed_file(collection):
+    """Retrieve the last processed file from MongoDB."""
+    last_file = collection.find_one(sort=[("processed_at", pymongo.DESCENDING)])
+    return last_file['file_key'] if last_file else None
+
+def configure_s3a(spark, config, limits):
+    """Point Spark's s3a filesystem at the Spaces endpoint and credentials of a do_spaces CONFIG section.
+
+    limits is the spark.s3a CONFIG section: the connection, thread and retry
+    caps that keep executors reading in parallel within Spaces' request rate.
+    """
+    hadoop_conf = spark.sparkContext._jsc.hadoopConfiguration()
+    hadoop_conf.set('fs.s3a.endpoint', config['endpoint'])
+    hadoop_conf.set('fs.s3a.access.key', config['access_key'])
+    hadoop_conf.set('fs.s3a.secret.key', config['secret_key'])
+    # Path-style requests work on Spaces and on local stand-ins such as moto
+    hadoop_conf.set('fs.s3a.path.style.access', 'true')
+    hadoop_conf.set('fs.s3a.connection.ssl.enabled', str(config['endpoint'].startswith('https')).lower())
+    hadoop_conf.set('fs.s3a.connection.maximum', str(limits['connection_maximum']))
+    hadoop_conf.set('fs.s3a.threads.max', str(limits['threads_maximum']))
+    hadoop_conf.set('fs.s3a.attempts.maximum', str(limits['attempts_maximum']))
+    hadoop_conf.set('fs.s3a.retry.throttle.limit', str(limits['retry_throttle_limit']))
+    hadoop_conf.set('fs.s3a.retry.throttle.interval', limits['retry_throttle_interval'])
+
+def read_source_lines(spark, config):
+    """Read every Content_latest file as a DataFrame of (file_key, line, content_hash), one row per non-blank line.
+
+    Files are split across the executors by Spark's text source instead of
+    being downloaded on the driver. file_key is the object key, the prefix
+    followed by the input file's name, whether the source is s3a or a local
+    directory. Files ending in .gz are decompressed by Spark. content_hash is
+    the SHA-256 of the raw line, computed in the JVM.
+    """
+    source = config['spark']['source']
+    if source is None:
+        configure_s3a(spark, config['do_spaces'], config['spark']['s3a'])
+        source = f"s3a://{config['do_spaces']['bucket']}/{config['do_spaces']['prefix']}"
+
+    df = spark.read.text(source).withColumnRenamed('value', 'line')
+    file_name = element_at(split(input_file_name(), '/'), -1)
+    df = df.withColumn('file_key', concat(lit(config['do_spaces']['prefix']), file_name))
+    df = df.filter(length(trim(col('line'))) > 0)
+    return df.withColumn('content_hash', sha2(col('line'), 256))
@@ -0,0 +1,60 @@
+import logging
+import os
+from pyspark.sql import SparkSession
+
+logger = logging.getLogger(__name__)
+
+# Settings every profile starts from
+COMMON_CONFIG = {
+    'spark.sql.adaptive.enabled': 'true',
+    'spark.sql.adaptive.coalescePartitions.enabled': 'true',
+    'spark.sql.execution.arrow.pyspark.enabled': 'true',
+    'spark.serializer': 'org.apache.spark.serializer.KryoSerializer'
+}
+
+# Named tuning profiles, applied on top of COMMON_CONFIG
+SPARK_PROFILES = {
+    # Laptop runs against a handful of files
+    'local-dev': {
+        'spark.master': 'local[2]',
+        'spark.driver.memory': '2g',
+        'spark.sql.shuffle.partitions': '4'
+    },
+    # Every core of one machine, executors living in the driver JVM
+    'single-node': {
+        'spark.master': 'local[*]',
+        'spark.driver.memory': '8g',
+        'spark.sql.shuffle.partitions': str((os.cpu_count() or 1) * 2)
+    },
+    # Submitted to a cluster manager, which supplies spark.master
+    'cluster': {
+        'spark.executor.memory': '8g',
+        'spark.executor.cores': '4',
+        'spark.driver.memory': '4g',
+        'spark.sql.shuffle.partitions': '200',
+        'spark.sql.adaptive.skewJoin.enabled': 'true'
+    }
+}
+
+_session = None
+
+def build_spark_config(profile, overrides=None):
+    """Return the Spark settings of a named profile, with overrides applied last."""
+    if profile not in SPARK_PROFILES:
+        raise ValueError(f"Unknown Spark profile: {profile}")
+    return {**COMMON_CONFIG, **SPARK_PROFILES[profile], **(overrides or {})}
+
+def get_spark_session(profile='single-node', app_name="DO Spaces File Processing", overrides=None):
+    """Return the process's SparkSession, building it with a profile on the first call.
+
+    The JVM only starts here, so importing the Spark jobs costs nothing until
+    they actually run. Later calls return the same session whatever they ask for.
+    """
+    global _session
+    if _session is None:
+        builder = SparkSession.builder.appName(app_name)
+        for key, value in build_spark_config(profile, overrides).items():
+            builder = builder.config(key, value)
+        _session = builder.getOrCreate()
+        logger.info(f"spark_session profile={profile} version={_session.version}")
+    return _session
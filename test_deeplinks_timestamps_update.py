@@ -0,0 +1,181 @@
+import random
+
+import pytest
+
+from deeplinks_timestamps_update import (
+    ObjectTask,
+    build_content_fields,
+    decode_raw_content,
+    iter_stale_ids,
+    reconcile_object,
+    select_shard,
+    shard_by_size,
+    stored_content_hash
+)
+
+KEY = 'Content/latest/Content_latest_es_netflix_jsonl'
+OBJ = {'Key': KEY, 'ETag': '"etag"', 'Size': 40}
+
+def counts(lines=1):
+    return {'lines': lines, 'bytes': 10}
+
+def test_chunks_in_order_advance_the_committed_prefix():
+    task = ObjectTask(OBJ)
+    assert task.chunk_written(counts(), (0, 10, 3)) == (False, True)
+    assert task.chunk_written(counts(), (10, 20, 5)) == (False, True)
+    assert (task.committed_offset, task.committed_line) == (20, 5)
+
+def test_out_of_order_chunk_waits_for_the_gap():
+    task = ObjectTask(OBJ)
+    assert task.chunk_written(counts(), (10, 20, 5)) == (False, False)
+    assert task.chunk_written(counts(), (20, 30, 8)) == (False, False)
+    assert (task.committed_offset, task.committed_line) == (0, 1)
+
+    assert task.chunk_written(counts(), (0, 10, 3)) == (False, True)
+    assert (task.committed_offset, task.committed_line) == (30, 8)
+    assert task.written_spans == {}
+
+def test_failed_chunk_stops_the_prefix_but_completes_the_object():
+    task = ObjectTask(OBJ)
+    task.set_chunk_count(4)
+    task.chunk_written(counts(), (0, 10, 3))
+    # The second chunk failed to write, so it brings no span
+    assert task.chunk_written(counts(), None) == (False, False)
+    assert task.chunk_written(counts(), (20, 30, 8)) == (False, False)
+    assert task.chunk_written(counts(0), (30, 30, 8)) == (True, False)
+    assert task.committed_offset == 10
+    assert task.totals['lines'] == 3
+
+def test_resumed_task_commits_after_its_checkpoint():
+    task = ObjectTask(OBJ, {'etag': '"etag"', 'offset': 20, 'line': 5})
+    assert task.seen_ids is None
+    assert task.chunk_written(counts(), (0, 10, 3)) == (False, False)
+    assert task.chunk_written(counts(), (20, 30, 8)) == (False, True)
+    assert (task.committed_offset, task.committed_line) == (30, 8)
+
+@pytest.mark.parametrize('order', [(0, 1, 2), (2, 1, 0), (1, 2, 0)])
+def test_unknown_line_numbers_still_commit_offsets(order):
+    spans = [(0, 10, None), (10, 20, None), (20, 30, None)]
+    task = ObjectTask(OBJ)
+    task.set_chunk_count(3)
+    results = [task.chunk_written(counts(), spans[index]) for index in order]
+    assert results[-1] == (True, True)
+    assert (task.committed_offset, task.committed_line) == (30, None)
+
+def test_stale_ids_are_the_stored_ones_not_seen():
+    stored = [(1, False), (3, False), (4, False), (7, False), (9, False)]
+    assert list(iter_stale_ids(stored, [1, 2, 4, 5, 6, 9, 10])) == [(3, False, False), (7, False, False)]
+
+def test_stale_ids_report_flagged_rows_whether_seen_or_not():
+    stored = [(1, True), (2, False), (3, True)]
+    assert list(iter_stale_ids(stored, [1, 2])) == [(1, True, True), (3, False, True)]
+
+@pytest.mark.parametrize('seen', [[], [100]])
+def test_stale_ids_past_the_seen_ids(seen):
+    stored = [(1, False), (2, False)]
+    assert list(iter_stale_ids(stored, seen)) == [(1, False, False), (2, False, False)]
+
+@pytest.fixture
+def rows():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.processed_files
+    collection.insert_many(
+        [{'file_key': KEY, 'extracted_id': extracted_id} for extracted_id in range(1, 11)]
+        + [{'file_key': 'other', 'extracted_id': extracted_id} for extracted_id in range(1, 11)]
+    )
+    return collection
+
+def stored_ids(collection, key=KEY):
+    return sorted(row['extracted_id'] for row in collection.find({'file_key': key}))
+
+def test_reconcile_deletes_only_the_objects_missing_rows(rows):
+    assert reconcile_object(rows, KEY, [8, 1, 2, 3, 4, 5, 6, 7], batch_size=1) == 2
+    assert stored_ids(rows) == list(range(1, 9))
+    assert stored_ids(rows, 'other') == list(range(1, 11))
+
+def test_reconcile_refuses_when_too_many_rows_look_stale(rows):
+    assert reconcile_object(rows, KEY, [1, 2, 3, 4], max_stale_fraction=0.5) is None
+    assert stored_ids(rows) == list(range(1, 11))
+    assert reconcile_object(rows, KEY, [1, 2, 3, 4, 5], max_stale_fraction=0.5) == 5
+
+def test_reconcile_flags_once_and_clears_returned_ids(rows):
+    assert reconcile_object(rows, KEY, range(1, 9), mode='flag') == 2
+    assert reconcile_object(rows, KEY, range(1, 9), mode='flag') == 0
+    assert reconcile_object(rows, KEY, range(1, 10), mode='flag') == 0
+    flagged = [row['extracted_id'] for row in rows.find({'stale_since': {'$exists': True}})]
+    assert flagged == [10]
+    assert stored_ids(rows) == list(range(1, 11))
+
+def test_reconcile_per_title_drops_the_source_then_the_title():
+    mongomock = pytest.importorskip('mongomock')
+    titles = mongomock.MongoClient().db.deeplink_titles
+    links = {'web': 'u'}
+    for extracted_id in range(1, 5):
+        # Title 1 is also on hbo
+        platforms = ('netflix', 'hbo') if extracted_id == 1 else ('netflix',)
+        titles.insert_one({
+            '_id': extracted_id,
+            'deeplinks': {'es': {platform: links for platform in platforms}},
+            'sources': {'es': {platform: {'content_hash': 'h'} for platform in platforms}},
+            'object_sources': [f"es.{platform}" for platform in platforms]
+        })
+
+    assert reconcile_object(titles, KEY, [3, 4], layout='per_title') == 2
+    assert titles.find_one({'_id': 1}) == {
+        '_id': 1,
+        'deeplinks': {'es': {'hbo': links}},
+        'sources': {'es': {'hbo': {'content_hash': 'h'}}},
+        'object_sources': ['es.hbo']
+    }
+    assert titles.find_one({'_id': 2}) is None
+    assert sorted(title['_id'] for title in titles.find()) == [1, 3, 4]
+
+# Many equal sizes, so the assignment depends on the tie-breaking
+LISTING = [{'Key': f"Content/latest/Content_latest_{index:03d}_jsonl", 'Size': (index % 5) * 1000} for index in range(60)]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_size_shards_do_not_depend_on_listing_order(seed):
+    listing = list(LISTING)
+    random.Random(seed).shuffle(listing)
+    assert shard_by_size(listing, 4) == shard_by_size(LISTING, 4)
+
+def test_size_shards_are_balanced():
+    assignment = shard_by_size(LISTING, 4)
+    loads = [0] * 4
+    for obj in LISTING:
+        loads[assignment[obj['Key']]] += obj['Size']
+    assert max(loads) - min(loads) <= max(obj['Size'] for obj in LISTING)
+
+@pytest.mark.parametrize('strategy', ['hash', 'size'])
+def test_shards_split_the_listing_exactly_once(strategy):
+    keys = [obj['Key'] for index in range(3) for obj in select_shard(iter(LISTING), (index, 3), strategy)]
+    assert sorted(keys) == sorted(obj['Key'] for obj in LISTING)
+
+CONTENT = {'Title': 'Año', 'ExternalIds': [{'ID': '42'}], 'Deeplinks': {'web': 'https://a'}, 'Year': 2019}
+
+def store(document, content, schema, raw_content=None):
+    """Apply the $set and $unset of build_content_fields to a stored document."""
+    fields, unset = build_content_fields(content, schema, raw_content)
+    document = {field: value for field, value in document.items() if field not in unset}
+    return {**document, **fields}
+
+@pytest.mark.parametrize('schema, raw_content, expected', [
+    ('full', None, CONTENT),
+    ('compact', 'zlib', CONTENT),
+    ('compact', None, None)
+])
+def test_raw_content_round_trip_across_schema_switches(schema, raw_content, expected):
+    for previous in [('full', None), ('compact', 'zlib'), ('compact', None)]:
+        document = store({'_id': 1}, {'stale': True}, *previous)
+        document = store(document, CONTENT, schema, raw_content)
+        assert decode_raw_content(document) == expected
+        # No copy of the line from the previous schema is left behind
+        assert {'content', 'content_zlib'} & document.keys() == build_content_fields(CONTENT, schema, raw_content)[0].keys()
+
+def test_stored_hash_differs_between_schemas():
+    hashes = {
+        stored_content_hash('h', schema, raw_content)
+        for schema, raw_content in [('full', None), ('compact', 'zlib'), ('compact', None)]
+    }
+    assert len(hashes) == 3
+    assert stored_content_hash('h', 'compact', 'zlib', layout='per_title') == 'h'
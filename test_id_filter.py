@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from deeplinks_timestamps_update import extract_numeric_id
+from id_filter import BloomFilter, build_filter, may_be_wanted, scan_external_id
+
+RECORDS = [
+    {'ExternalIds': [{'ID': '42'}]},
+    {'ExternalIds': [{'ID': 42}]},
+    {'ExternalIds': [{'Source': 'imdb', 'ID': '0042'}]},
+    {'ExternalIds': [{'ID': 'tt0042'}, {'ID': '7'}]},
+    {'ExternalIds': [{'ID': '12a'}, {'ID': 8}]},
+    {'ExternalIds': [{'Source': 'x'}, {'ID': '9', 'UID': '1'}]},
+    {'UID': '5', 'Title': 'ID', 'ExternalIds': [{'ID': '10'}], 'Deeplinks': {'web': 'https://x/ID/11'}},
+    {'Deeplinks': {'web': 'u'}, 'ExternalIds': [{'ID': '12'}]},
+    {'ExternalIds': [{'ID': 'none'}]},
+    {'ExternalIds': []},
+    {'Title': 'no ids'}
+]
+
+@pytest.mark.parametrize('separators', [(', ', ': '), (',', ':')])
+@pytest.mark.parametrize('record', RECORDS)
+def test_scan_agrees_with_extract_numeric_id(record, separators):
+    extracted_id = extract_numeric_id(record)
+    line = json.dumps(record, separators=separators).encode('utf-8')
+    if extracted_id is not None:
+        assert scan_external_id(line) == extracted_id
+        # A line the decode keeps must never be screened out
+        assert may_be_wanted(build_filter([extracted_id]), line)
+
+def test_line_without_a_scannable_id_is_kept():
+    id_filter = build_filter(str(value) for value in range(1000, 2000))
+    assert may_be_wanted(id_filter, b'{"Title": "no ids"}')
+    assert may_be_wanted(id_filter, b'{"ExternalIds": [{"ID": "1500"}]}')
+    assert not may_be_wanted(id_filter, b'{"ExternalIds": [{"ID": "2"}]}')
+
+def test_bloom_filter_save_load_round_trip(tmp_path):
+    ids = range(0, 30000, 3)
+    id_filter = build_filter(str(value) for value in ids)
+    path = tmp_path / 'wanted.bloom'
+    id_filter.save(path)
+
+    loaded = BloomFilter.load(path)
+    assert (loaded.size_bits, loaded.hash_count, loaded.bits) == (id_filter.size_bits, id_filter.hash_count, id_filter.bits)
+    assert all(value in loaded for value in ids)
+    false_positives = sum(value in loaded for value in range(1, 30000, 3))
+    assert false_positives < 10000 * 0.01
+
+def test_bloom_filter_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'wanted.bloom'
+    build_filter(['1', '2']).save(path)
+    data = path.read_bytes()
+
+    path.write_bytes(data[:-1])
+    with pytest.raises(ValueError, match='truncated'):
+        BloomFilter.load(path)
+
+    path.write_bytes(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match='not a Bloom filter'):
+        BloomFilter.load(path)
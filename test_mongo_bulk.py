@@ -0,0 +1,70 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from mongo_bulk import DUPLICATE_KEY_ERROR, BulkUpsertWriter
+
+class FakeCollection:
+    """bulk_write that answers each call with the next scripted result and records what it was sent."""
+
+    name = 'fake'
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls.append(list(operations))
+        result = {'nUpserted': 0, 'nModified': 0, 'nMatched': 0, 'writeErrors': [], **self.results.pop(0)}
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return type('BulkWriteResult', (), {'bulk_api_result': result})()
+
+def upsert(extracted_id):
+    return UpdateOne({'_id': extracted_id, 'content_hash': {'$ne': 'h'}}, {'$set': {'content_hash': 'h'}}, upsert=True)
+
+def rejected(*indexes, code=DUPLICATE_KEY_ERROR):
+    return [{'index': index, 'code': code, 'errmsg': f"E{code}"} for index in indexes]
+
+def test_duplicates_are_skipped_and_other_errors_counted():
+    collection = FakeCollection({'nUpserted': 1, 'writeErrors': rejected(1, 2) + rejected(3, code=2)})
+    with BulkUpsertWriter(collection) as writer:
+        for extracted_id in range(4):
+            writer.add(upsert(extracted_id))
+
+    assert len(collection.calls) == 1
+    assert {field: writer.totals[field] for field in ('upserted', 'skipped', 'retried', 'errors')} == {
+        'upserted': 1, 'skipped': 2, 'retried': 0, 'errors': 1
+    }
+
+def test_retry_resends_duplicates_as_plain_updates():
+    collection = FakeCollection(
+        {'nUpserted': 1, 'writeErrors': rejected(1, 2, 3)},
+        # Only the operation that lost an insert race matches on the retry
+        {'nMatched': 1, 'nModified': 1}
+    )
+    with BulkUpsertWriter(collection, retry_duplicates=True) as writer:
+        for extracted_id in range(4):
+            writer.add(upsert(extracted_id))
+
+    first, retry = collection.calls
+    assert retry == [UpdateOne(operation._filter, operation._doc, upsert=False) for operation in first[1:]]
+    assert {field: writer.totals[field] for field in ('upserted', 'modified', 'skipped', 'retried', 'errors')} == {
+        'upserted': 1, 'modified': 1, 'skipped': 2, 'retried': 3, 'errors': 0
+    }
+
+def test_retry_errors_are_not_counted_as_skipped():
+    collection = FakeCollection({'writeErrors': rejected(0, 1)}, {'writeErrors': rejected(0, code=2)})
+    with BulkUpsertWriter(collection, retry_duplicates=True) as writer:
+        writer.add(upsert(1))
+        writer.add(upsert(2))
+
+    assert (writer.totals['skipped'], writer.totals['retried'], writer.totals['errors']) == (1, 2, 1)
+
+def test_no_retry_without_duplicates():
+    collection = FakeCollection({'nUpserted': 2}, {'nMatched': 1})
+    with BulkUpsertWriter(collection, batch_size=2, retry_duplicates=True) as writer:
+        for extracted_id in range(3):
+            writer.add(upsert(extracted_id))
+
+    assert [len(call) for call in collection.calls] == [2, 1]
+    assert (writer.totals['batches'], writer.totals['operations'], writer.totals['retried']) == (2, 3, 0)
@@ -0,0 +1,107 @@
+import gzip
+import io
+import time
+
+import pytest
+
+from spaces_reader import GzipStreamReader, iter_object_lines, iter_object_range_blocks
+
+LINES = [f'{{"id": {i}, "title": "title {i % 7}"}}' for i in range(3000)]
+RAW = ''.join(line + '\n' for line in LINES).encode('utf-8')
+
+class FakeS3:
+    """get_object over one in-memory object, honouring Range headers."""
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = 0
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.requests += 1
+        data = self.data
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            if int(start) >= len(data):
+                raise ValueError(f"416 InvalidRange: {Range}")
+            data = data[int(start):int(end) + 1] if end else data[int(start):]
+        return {'Body': io.BytesIO(data)}
+
+def read_all(stream, size):
+    out = b''
+    while True:
+        data = stream.read(size)
+        if not data:
+            return out
+        out += data
+
+def members(*parts):
+    return b''.join(gzip.compress(part) for part in parts)
+
+@pytest.mark.parametrize('chunk_size', [16, 64, 1000, 1024 * 1024])
+@pytest.mark.parametrize('read_size', [10, 100, 65536])
+def test_gzip_single_member(chunk_size, read_size):
+    reader = GzipStreamReader(io.BytesIO(gzip.compress(RAW)), chunk_size)
+    assert read_all(reader, read_size) == RAW
+
+@pytest.mark.parametrize('chunk_size', [16, 64, 1000, 1024 * 1024])
+@pytest.mark.parametrize('read_size', [10, 100, 65536])
+def test_gzip_multi_member(chunk_size, read_size):
+    thirds = (RAW[:20000], RAW[20000:50000], RAW[50000:])
+    reader = GzipStreamReader(io.BytesIO(members(*thirds)), chunk_size)
+    assert read_all(reader, read_size) == RAW
+
+def test_gzip_truncated_member_raises():
+    data = gzip.compress(RAW)
+    reader = GzipStreamReader(io.BytesIO(data[:len(data) // 2]), 64)
+    with pytest.raises(EOFError):
+        read_all(reader, 100)
+
+@pytest.mark.parametrize('key', ['Content_latest_es_x_jsonl', 'Content_latest_es_x_jsonl.gz'])
+def test_object_lines_multi_member_by_suffix_and_magic(key):
+    s3 = FakeS3(members(RAW[:30000], RAW[30000:]))
+    lines = [line for _, line in iter_object_lines(s3, 'bucket', key, chunk_size=64)]
+    assert lines == LINES
+
+@pytest.mark.parametrize('key', ['Content_latest_es_x_jsonl', 'Content_latest_es_x_jsonl.gz'])
+def test_object_lines_resume_offset(key):
+    start = RAW.index(LINES[2500].encode('utf-8'))
+    s3 = FakeS3(members(RAW[:30000], RAW[30000:]))
+    lines = [line for _, line in iter_object_lines(s3, 'bucket', key, chunk_size=64, start=start)]
+    assert lines == LINES[2500:]
+
+@pytest.mark.parametrize('range_workers', [0, 4])
+def test_object_lines_checkpoint_at_end(range_workers):
+    s3 = FakeS3(RAW)
+    lines = list(iter_object_lines(s3, 'bucket', 'key.jsonl', size=len(RAW), range_size=1000,
+                                   range_workers=range_workers, start=len(RAW), compression=None))
+    assert lines == []
+    assert s3.requests == 0
+
+def test_object_lines_checkpoint_at_end_compressed():
+    s3 = FakeS3(members(RAW[:30000], RAW[30000:]))
+    lines = list(iter_object_lines(s3, 'bucket', 'key.jsonl.gz', size=len(s3.data), start=len(RAW)))
+    assert lines == []
+
+def test_range_blocks_from_end_issue_no_request():
+    s3 = FakeS3(RAW)
+    assert list(iter_object_range_blocks(s3, 'bucket', 'key', len(RAW), range_size=1000, start=len(RAW))) == []
+    assert s3.requests == 0
+
+@pytest.mark.parametrize('start', [0, RAW.index(LINES[1000].encode('utf-8'))])
+def test_range_blocks_cover_every_line_once(start):
+    s3 = FakeS3(RAW)
+    blocks = sorted(iter_object_range_blocks(s3, 'bucket', 'key', len(RAW), range_size=1000, max_workers=4, start=start))
+    offset = start
+    for block_offset, block in blocks:
+        assert block_offset == offset
+        offset += len(block)
+    assert b''.join(block for _, block in blocks) == RAW[start:]
+
+def test_range_blocks_keep_a_bounded_window():
+    s3 = FakeS3(RAW)
+    blocks = iter_object_range_blocks(s3, 'bucket', 'key', len(RAW), range_size=1000, max_workers=4)
+    next(blocks)
+    # A stalled consumer must not let the remaining ranges be fetched
+    time.sleep(0.2)
+    assert s3.requests <= 4 + 1
+    blocks.close()
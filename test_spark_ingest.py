@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+pytest.importorskip('pyspark')
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import lit
+from spark_ingest import EXTRACTED_SCHEMA, extract_fields, extract_fields_pandas, extract_row, to_long
+
+LINES = [
+    json.dumps({
+        'Title': 'A', 'CleanTitle': 'a', 'OriginalTitle': 'Á', 'Type': 'movie', 'Year': 2019, 'Duration': '95',
+        'ExternalIds': [{'ID': '42'}], 'Deeplinks': {'web': 'https://a', 'ios': None}
+    }),
+    json.dumps({'ExternalIds': [{'ID': 'tt1'}, {'ID': 7}], 'Deeplinks': {'web': {'url': 'https://b', 'rank': 1}}}),
+    json.dumps({'Year': '2019.7', 'Duration': 'n/a', 'ExternalIds': [], 'Deeplinks': ['https://c']}),
+    json.dumps({'Year': -3.2, 'Duration': True, 'OriginalTitle': None, 'Deeplinks': 'https://d'}),
+    json.dumps({'Title': None, 'Year': ' 12 ', 'ExternalIds': [{'Source': 'x'}, {'ID': '0008'}]}),
+    json.dumps([1, 2]),
+    '{"Title": "truncated", "Year": 20',
+    'ERROR exporting 1'
+]
+
+# Text of JSON numbers and strings as from_json leaves them in a string field
+CAST_VALUES = ['2019', '2019.7', '-3.2', ' 12 ', '+5', 'n/a', '']
+
+@pytest.fixture(scope='module')
+def spark():
+    session = SparkSession.builder.master('local[1]').appName('test_spark_ingest').getOrCreate()
+    yield session
+    session.stop()
+
+def extracted(df):
+    return {row['line']: tuple(row[field] for field in EXTRACTED_SCHEMA.fieldNames()) for row in df.collect()}
+
+def test_extract_row_matches_native_extraction(spark):
+    df = spark.createDataFrame([(line,) for line in LINES], ['line'])
+    native = extracted(extract_fields(df))
+    assert native == {line: extract_row(line) for line in LINES}
+
+def test_pandas_extraction_matches_native_extraction(spark):
+    pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    df = spark.createDataFrame([(line,) for line in LINES], ['line'])
+    assert extracted(extract_fields_pandas(df)) == extracted(extract_fields(df))
+
+def test_to_long_matches_the_spark_cast(spark):
+    row = spark.range(1).select(*[lit(value).cast('long').alias(str(index)) for index, value in enumerate(CAST_VALUES)])
+    casts = row.collect()[0]
+    assert [to_long(value) for value in CAST_VALUES] == [casts[str(index)] for index in range(len(CAST_VALUES))]